@@ -1,119 +1,319 @@
+import base64
+import hashlib
 import logging
 import os
-from typing import IO, Any, Dict, Generator, Iterable, Optional
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from operator import itemgetter
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from botocore.client import BaseClient
 
+try:
+    import google_crc32c
+except ImportError:  # pragma: no cover
+    google_crc32c = None  # type: ignore[assignment, unused-ignore]
+
 from hai.event_emitter import EventEmitter
 
 S3_MINIMUM_MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024
 S3_MAXIMUM_MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024 * 1024
 S3_MINIMUM_MULTIPART_FILE_SIZE = S3_MINIMUM_MULTIPART_CHUNK_SIZE
 
+CHECKSUM_ALGORITHMS = {"md5", "crc32c"}
+
+Buffer = Union[bytes, bytearray, memoryview]
+# Size of the blocks (copies of) non-`bytes` buffers are fed to `google_crc32c` in.
+_CRC32C_BLOCK_SIZE = 1024 * 1024
+T = TypeVar("T")
+
 
 class MultipartUploader(EventEmitter):
-    event_types = {
-        "progress",
-        "part-error",
-    }
+    event_types = frozenset(
+        {
+            "progress",
+            "part-error",
+        },
+    )
     part_retry_attempts = 10
     minimum_file_size = S3_MINIMUM_MULTIPART_FILE_SIZE
     minimum_chunk_size = S3_MINIMUM_MULTIPART_CHUNK_SIZE
     maximum_chunk_size = 150 * 1024 * 1024
-    default_chunk_size = 50 * 1024 * 1024
+    default_chunk_size = 100 * 1024 * 1024
+    default_max_concurrency = 4
+    read_ahead_parts = 1
+    abort_drain_timeout = 30
 
-    def __init__(self, s3: BaseClient, log: Optional[logging.Logger] = None) -> None:
+    def __init__(
+        self,
+        s3: BaseClient,
+        log: Optional[logging.Logger] = None,
+        max_concurrency: Optional[int] = None,
+        checksum: Optional[str] = None,
+    ) -> None:
         """
         :param s3: The boto3 S3 client to upload with
         :param log: A logger, if desired.
+        :param max_concurrency: Maximum number of parts to upload (and hold in memory) at once.
+                                Defaults to `default_max_concurrency`.
+        :param checksum: Checksum algorithm to compute for each part while uploading, if any.
+                         "md5" sends each part's `Content-MD5`, and makes the expected ETag of
+                         the uploaded object available as `.etag` after an upload.
+                         "crc32c" (requires the `google-crc32c` package; `pip install hai[crc32c]`)
+                         sends each part's CRC32C checksum, and makes the composite checksum available
+                         as `.checksum` after an upload.
         """
+        if checksum is not None and checksum not in CHECKSUM_ALGORITHMS:
+            raise ValueError(f"Unknown checksum algorithm {checksum!r} (must be one of {CHECKSUM_ALGORITHMS})")
+        if checksum == "crc32c" and google_crc32c is None:  # pragma: no cover
+            raise ImportError("The `google-crc32c` package is required for CRC32C checksums")
         self.s3 = s3
         self.log = log or logging.getLogger(self.__class__.__name__)
+        self.max_concurrency = max(1, int(max_concurrency or self.default_max_concurrency))
+        # Bounds for automatically determined chunk sizes.
+        self._min_chunk_size = max(S3_MINIMUM_MULTIPART_CHUNK_SIZE, self.minimum_chunk_size)
+        self._max_chunk_size = min(S3_MAXIMUM_MULTIPART_CHUNK_SIZE, self.maximum_chunk_size)
+        self.checksum_algorithm = checksum
+        self.etag: Optional[str] = None
+        self.checksum: Optional[str] = None
+        self._check_connection_pool_size()
+
+    def _check_connection_pool_size(self) -> None:
+        # With fewer pooled connections than concurrent part uploads, botocore keeps
+        # discarding and reopening (TLS) connections between parts.
+        pool_size = getattr(getattr(self.s3.meta, "config", None), "max_pool_connections", None)
+        if isinstance(pool_size, int) and pool_size < self.max_concurrency:
+            self.log.warning(
+                f"The S3 client's max_pool_connections ({pool_size}) is less than max_concurrency "
+                f"({self.max_concurrency}); consider passing `botocore.config.Config(max_pool_connections=...)` "
+                f"when creating the client",
+            )
 
     def upload_parts(
         self,
         bucket: str,
         key: str,
-        parts: Iterable[bytes],
+        parts: Iterable[Buffer],
         create_params: Optional[Dict[str, Any]] = None,
+        total_parts: Optional[int] = None,
     ) -> Dict[str, Any]:
         """
         Upload the given parts of binary data as a multipart upload.
 
+        A `progress` event is emitted as each part is uploaded, with `part_number`, `part` (the `upload_part`
+        response), `bytes_uploaded`, `completed_parts` and `total_parts` (which may be None) arguments.
+
         :param bucket: Bucket to upload to.
         :param key: Key to upload to.
-        :param parts: Iterable (may be a generator) of bytes to upload.
+        :param parts: Iterable (may be a generator) of bytes-like objects to upload.
                       It is expected that these chunks all correspond to S3's standards, i.e.
                       are >= S3_MINIMUM_MULTIPART_CHUNK_SIZE (aside from the last part).
                       If they aren't, completing the upload will fail.
         :param create_params: Any additional parameters to pass to `create_multipart_upload`.
                               These roughly correspond to what one might be able to pass to `put_object`.
+        :param total_parts: The number of parts, if known. Only used for progress events.
         :return: The return value of `complete_multipart_upload`.
         """
-        if create_params is None:
-            create_params = {}
+        return self._upload_parts(bucket, key, parts, create_params=create_params, total_parts=total_parts)
+
+    def _upload_parts(
+        self,
+        bucket: str,
+        key: str,
+        parts: Iterable[Buffer],
+        create_params: Optional[Dict[str, Any]] = None,
+        part_done: Optional[Callable[[int, Buffer], None]] = None,
+        total_parts: Optional[int] = None,
+        before_abort: Optional[Callable[[], None]] = None,
+    ) -> Dict[str, Any]:
+        # `part_done` is called with the part number and chunk once each part upload is done with
+        # (successfully or not); this may happen in a worker thread.
+        # `before_abort` is called before aborting a failed upload, e.g. to stop producing parts.
+        create_params = dict(create_params or {})
+        if self.checksum_algorithm == "crc32c":
+            create_params.setdefault("ChecksumAlgorithm", "CRC32C")
+        self.etag = self.checksum = None
         mpu = self.s3.create_multipart_upload(Bucket=bucket, Key=key, **create_params)
-        part_infos = []
-        bytes = 0
+        upload = _UploadState(upload_id=mpu["UploadId"], total_parts=total_parts)
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix=self.__class__.__name__,
+        )
         try:
             for part_number, chunk in enumerate(parts, 1):
-                for attempt in range(self.part_retry_attempts):
-                    try:
-                        part = self.s3.upload_part(
-                            Bucket=bucket,
-                            Key=key,
-                            PartNumber=part_number,
-                            UploadId=mpu["UploadId"],
-                            Body=chunk,
-                        )
-                    except Exception as exc:
-                        self.log.error(
-                            f"Error uploading part {part_number} (attempt {attempt})",
-                            exc_info=True,
-                        )
-                        self.emit(
-                            "part-error",
-                            {
-                                "chunk": part_number,
-                                "attempt": attempt,
-                                "attempts_left": self.part_retry_attempts - attempt,
-                                "exception": exc,
-                            },
-                        )
-                        if attempt == self.part_retry_attempts - 1:
-                            raise
-                    else:
-                        bytes += len(chunk)
-                        part_infos.append(
-                            {"PartNumber": part_number, "ETag": part["ETag"]},
-                        )
-                        self.emit(
-                            "progress",
-                            {
-                                "part_number": part_number,
-                                "part": part,
-                                "bytes_uploaded": bytes,
-                            },
-                        )
-                        break
+                # Don't read further ahead than we can upload;
+                # this bounds the number of chunks held in memory.
+                while len(upload.pending) >= self.max_concurrency:
+                    self._collect_parts(upload, FIRST_COMPLETED)
+                future = executor.submit(
+                    self._upload_part,
+                    bucket=bucket,
+                    key=key,
+                    upload_id=upload.upload_id,
+                    part_number=part_number,
+                    chunk=chunk,
+                    aborting=upload.aborting,
+                )
+                upload.pending[future] = (part_number, len(chunk))
+                if part_done is not None:
+                    future.add_done_callback(partial(_call_part_done, part_done, part_number, chunk))
+            while upload.pending:
+                self._collect_parts(upload, FIRST_COMPLETED)
         except:  # noqa
-            self.log.debug("Aborting multipart upload")
-            self.s3.abort_multipart_upload(
-                Bucket=bucket,
-                Key=key,
-                UploadId=mpu["UploadId"],
-            )
+            if before_abort is not None:
+                before_abort()
+            self._abort_upload(bucket, key, upload, executor)
             raise
+        executor.shutdown(wait=True)
 
         self.log.info("Completing multipart upload")
 
-        return self.s3.complete_multipart_upload(  # type: ignore[no-any-return]
+        upload.part_infos.sort(key=itemgetter("PartNumber"))
+        result = self.s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload.upload_id,
+            MultipartUpload={"Parts": upload.part_infos},
+        )
+        if upload.part_digests:
+            self._set_composite_checksum([upload.part_digests[n] for n in sorted(upload.part_digests)])
+        return result  # type: ignore[no-any-return]
+
+    def _abort_upload(self, bucket: str, key: str, upload: "_UploadState", executor: ThreadPoolExecutor) -> None:
+        # Make sure no parts are uploading anymore before aborting the upload;
+        # parts that finish uploading after the abort would linger (and cost) in S3.
+        upload.aborting.set()  # Stop retrying failing parts
+        for future in upload.pending:
+            future.cancel()
+        _, still_running = wait(upload.pending, timeout=self.abort_drain_timeout)
+        if still_running:
+            self.log.warning(f"Aborting multipart upload with {len(still_running)} parts still uploading")
+        executor.shutdown(wait=False)
+        self.log.debug("Aborting multipart upload")
+        self.s3.abort_multipart_upload(
             Bucket=bucket,
             Key=key,
-            UploadId=mpu["UploadId"],
-            MultipartUpload={"Parts": part_infos},
+            UploadId=upload.upload_id,
         )
 
+    def _collect_parts(self, upload: "_UploadState", return_when: str) -> None:
+        """
+        Wait for pending part uploads to finish, and record their results.
+
+        :raises: The exception of a part upload that failed for good.
+        """
+        done, _ = wait(upload.pending, return_when=return_when)
+        for future in sorted(done, key=lambda f: upload.pending[f][0]):
+            part_number, chunk_length = upload.pending.pop(future)
+            part, digest = future.result()
+            upload.bytes_uploaded += chunk_length
+            upload.part_infos.append(
+                {"PartNumber": part_number, "ETag": part["ETag"], **self._get_checksum_params(digest)},
+            )
+            if digest is not None:
+                upload.part_digests[part_number] = digest
+            self.emit(
+                "progress",
+                part_number=part_number,
+                part=part,
+                bytes_uploaded=upload.bytes_uploaded,
+                completed_parts=len(upload.part_infos),
+                total_parts=upload.total_parts,
+            )
+
+    def _compute_digest(self, data: Buffer) -> Optional[bytes]:
+        if self.checksum_algorithm == "md5":
+            return hashlib.md5(data).digest()
+        if self.checksum_algorithm == "crc32c":
+            return _crc32c(data).to_bytes(4, "big")
+        return None
+
+    def _get_checksum_params(self, digest: Optional[bytes]) -> Dict[str, str]:
+        # Checksum parameters for `upload_part` and the parts of `complete_multipart_upload`.
+        if digest is not None and self.checksum_algorithm == "crc32c":
+            return {"ChecksumCRC32C": base64.b64encode(digest).decode()}
+        return {}
+
+    def _set_composite_checksum(self, part_digests: List[bytes]) -> None:
+        # S3 computes multipart checksums as the checksum of the concatenated part checksums,
+        # suffixed with the number of parts.
+        digest = self._compute_digest(b"".join(part_digests))
+        assert digest is not None
+        suffix = f"-{len(part_digests)}"
+        if self.checksum_algorithm == "md5":
+            self.etag = f'"{digest.hex()}{suffix}"'
+        elif self.checksum_algorithm == "crc32c":  # pragma: no branch
+            self.checksum = base64.b64encode(digest).decode() + suffix
+
+    def _upload_part(
+        self,
+        bucket: str,
+        key: str,
+        upload_id: str,
+        part_number: int,
+        chunk: Buffer,
+        aborting: Optional[threading.Event] = None,
+    ) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        """
+        Upload a single part, retrying up to `part_retry_attempts` times
+        (unless the `aborting` event gets set).
+
+        This is run in a worker thread; `part-error` events are thus emitted from that thread.
+
+        :return: The `upload_part` response, and the part's checksum digest (if a checksum algorithm is set).
+        """
+        body = _get_body(chunk)
+        digest = self._compute_digest(body)
+        checksum_params = self._get_checksum_params(digest)
+        if self.checksum_algorithm == "md5":
+            # Only sent along with `upload_part`, not `complete_multipart_upload`.
+            checksum_params["ContentMD5"] = base64.b64encode(digest).decode()  # type: ignore[arg-type]
+        attempt = 0
+        while True:
+            try:
+                part = self.s3.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    Body=body,
+                    # Spare botocore from having to seek the body to figure out its length.
+                    ContentLength=len(body),
+                    **checksum_params,
+                )
+                return (part, digest)
+            except Exception as exc:
+                self.log.error(
+                    f"Error uploading part {part_number} (attempt {attempt})",
+                    exc_info=True,
+                )
+                self.emit(
+                    "part-error",
+                    chunk=part_number,
+                    attempt=attempt,
+                    attempts_left=self.part_retry_attempts - attempt,
+                    exception=exc,
+                )
+                if attempt >= self.part_retry_attempts - 1 or (aborting and aborting.is_set()):
+                    raise
+                attempt += 1
+
     def read_chunk(self, fp: IO[bytes], size: int) -> bytes:
         """
         Read a chunk of up to size `size` from the filelike object `fp`.
@@ -122,6 +322,17 @@ class MultipartUploader(EventEmitter):
         """
         return fp.read(size)
 
+    def read_chunk_into(self, fp: IO[bytes], buffer: bytearray) -> memoryview:
+        """
+        Read a chunk of up to `len(buffer)` bytes from the filelike object `fp` into `buffer`.
+
+        This is used instead of `read_chunk` when `fp` supports `readinto()`
+        and `read_chunk` has not been overridden, so buffers can be reused between parts.
+
+        :return: A memoryview over the part of `buffer` that was read into.
+        """
+        return memoryview(buffer)[: fp.readinto(buffer)]  # type: ignore[attr-defined]
+
     def upload_file(
         self,
         bucket: str,
@@ -133,6 +344,9 @@ class MultipartUploader(EventEmitter):
         """
         Upload the given file in chunks.
 
+        The file is read sequentially, from its current position, by a single background thread
+        that reads ahead of the part uploads; `fp` must not be used elsewhere during the upload.
+
         :param bucket: Bucket to upload to.
         :param key: Key to upload to.
         :param fp: File-like object to upload.
@@ -155,33 +369,276 @@ class MultipartUploader(EventEmitter):
                 f"(must be at least {self.minimum_file_size} bytes)",
             )
 
+        chunk_size = self._get_chunk_size(size, chunk_size)
+
+        stop_reading = threading.Event()
+        buffer_pool: Optional[_BufferPool] = None
+        if self._can_read_into(fp):
+            # No need for buffers larger than what's left to read (e.g. for small streams of unknown size).
+            remaining_size = _get_remaining_size(fp)
+            buffer_pool = _BufferPool(
+                buffer_size=(min(chunk_size, remaining_size) if remaining_size else chunk_size),
+                # One buffer for each part being uploaded or read ahead, plus one for the part being read.
+                max_buffers=(self.max_concurrency + self.read_ahead_parts + 1),
+            )
+            chunks: Iterator[Buffer] = self._read_chunks_into(fp, buffer_pool, stop_reading)
+        else:
+            chunks = self._read_chunks(fp, chunk_size)
+
+        # For real files, let the kernel know we'll be reading sequentially,
+        # and that uploaded parts need not linger in the page cache.
+        sequential_file = _advise_sequential(fp) if size else None
+
+        def part_done(part_number: int, chunk: Buffer) -> None:
+            if buffer_pool is not None and isinstance(chunk, memoryview):
+                buffer_pool.put(chunk.obj)  # type: ignore[arg-type]
+            if sequential_file is not None:
+                fd, start_offset = sequential_file
+                offset = start_offset + (part_number - 1) * chunk_size
+                _fadvise(fd, offset, len(chunk), "POSIX_FADV_DONTNEED")
+
+        parts = _ReadAhead(chunks, self.read_ahead_parts, stop=stop_reading)
+        # Make sure `fp` isn't being read anymore once we're done (e.g. while aborting the upload).
+        close_parts = partial(parts.close, timeout=self.abort_drain_timeout)
+        try:
+            return self._upload_parts(
+                bucket,
+                key,
+                parts=parts,
+                create_params=create_params,
+                part_done=part_done,
+                # Assuming the file is read from its start, as it usually is.
+                total_parts=(-(-size // chunk_size) if size else None),
+                before_abort=close_parts,
+            )
+        finally:
+            close_parts()
+
+    def _read_chunks(self, fp: IO[bytes], chunk_size: int) -> Generator[bytes, None, None]:
+        while True:
+            chunk = self.read_chunk(fp, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def _read_chunks_into(
+        self,
+        fp: IO[bytes],
+        buffer_pool: "_BufferPool",
+        stop: threading.Event,
+    ) -> Generator[memoryview, None, None]:
+        while True:
+            buffer = buffer_pool.get(stop)
+            if buffer is None:  # Stopped while waiting for a buffer
+                break
+            chunk = self.read_chunk_into(fp, buffer)
+            if not chunk:
+                break
+            yield chunk
+
+    def _get_chunk_size(self, file_size: Optional[int], chunk_size: Optional[int]) -> int:
         if not chunk_size:
-            chunk_size = self.determine_chunk_size_from_file_size(size)
-            minimum = max(S3_MINIMUM_MULTIPART_CHUNK_SIZE, self.minimum_chunk_size)
-            maximum = min(S3_MAXIMUM_MULTIPART_CHUNK_SIZE, self.maximum_chunk_size)
-            chunk_size = int(max(minimum, min(chunk_size, maximum)))
+            chunk_size = self.determine_chunk_size_from_file_size(file_size)
+            chunk_size = max(self._min_chunk_size, min(chunk_size, self._max_chunk_size))
 
-        if not S3_MINIMUM_MULTIPART_CHUNK_SIZE <= chunk_size < S3_MAXIMUM_MULTIPART_CHUNK_SIZE:
+        if not S3_MINIMUM_MULTIPART_CHUNK_SIZE <= chunk_size <= S3_MAXIMUM_MULTIPART_CHUNK_SIZE:
             raise ValueError(
                 f"Chunk size {chunk_size} is outside the protocol limits "
                 f"({S3_MINIMUM_MULTIPART_CHUNK_SIZE}..{S3_MAXIMUM_MULTIPART_CHUNK_SIZE})",
             )
+        return chunk_size
 
-        def chunk_generator() -> Generator[bytes, None, None]:
-            while True:
-                chunk = self.read_chunk(fp, chunk_size)
-                if not chunk:
-                    break
-                yield chunk
-
-        return self.upload_parts(
-            bucket,
-            key,
-            parts=chunk_generator(),
-            create_params=create_params,
-        )
+    def _can_read_into(self, fp: IO[bytes]) -> bool:
+        # Subclasses overriding `read_chunk` (e.g. to compute checksums) expect it to be called.
+        return hasattr(fp, "readinto") and type(self).read_chunk is MultipartUploader.read_chunk
 
     def determine_chunk_size_from_file_size(self, file_size: Optional[int]) -> int:
         if file_size:
-            return int(file_size / 20)
+            return file_size // 20
         return self.default_chunk_size
+
+
+class _BufferPool:
+    """
+    A pool of reusable buffers, allocated only as they're needed (up to `max_buffers`).
+    """
+
+    def __init__(self, buffer_size: int, max_buffers: int) -> None:
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free: queue.Queue[bytearray] = queue.Queue()
+        self._allocated = 0
+        self._lock = threading.Lock()
+
+    def get(self, stop: Optional[threading.Event] = None) -> Optional[bytearray]:
+        """
+        Get a free buffer, allocating a new one if none is free and the limit allows,
+        and waiting for one to be returned otherwise.
+
+        :param stop: An event to give up waiting on.
+        :return: The buffer, or None if `stop` was set while waiting.
+        """
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._allocated < self.max_buffers:
+                self._allocated += 1
+                return bytearray(self.buffer_size)
+        while True:
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    return None
+
+    def put(self, buffer: bytearray) -> None:
+        self._free.put(buffer)
+
+
+class _UploadState:
+    """
+    Bookkeeping for a multipart upload in progress.
+    """
+
+    def __init__(self, upload_id: str, total_parts: Optional[int] = None) -> None:
+        self.upload_id = upload_id
+        self.total_parts = total_parts
+        self.part_infos: List[Dict[str, Any]] = []
+        self.part_digests: Dict[int, bytes] = {}
+        self.bytes_uploaded = 0
+        self.aborting = threading.Event()
+        # Map of part upload futures to their part number and length.
+        self.pending: Dict[Future[Tuple[Dict[str, Any], Optional[bytes]]], Tuple[int, int]] = {}
+
+
+def _call_part_done(
+    part_done: Callable[[int, Buffer], None],
+    part_number: int,
+    chunk: Buffer,
+    future: "Future[Any]",
+) -> None:
+    part_done(part_number, chunk)
+
+
+def _advise_sequential(fp: IO[bytes]) -> Optional[Tuple[int, int]]:
+    """
+    Advise the OS that `fp` will be read sequentially from its current position, if possible.
+
+    :return: The file descriptor and the current offset, if advice can be given.
+    """
+    if not hasattr(os, "posix_fadvise"):  # pragma: no cover
+        return None
+    try:
+        fd = fp.fileno()
+        offset = fp.tell()
+    except (OSError, AttributeError, ValueError):  # pragma: no cover
+        return None
+    if not _fadvise(fd, offset, 0, "POSIX_FADV_SEQUENTIAL"):  # pragma: no cover
+        return None
+    return (fd, offset)
+
+
+def _crc32c(data: Buffer) -> int:
+    # `google_crc32c`'s C extension only accepts `bytes`, so other buffers are copied,
+    # but only a block at a time, instead of copying whole (possibly huge) parts.
+    if isinstance(data, bytes):
+        return int(google_crc32c.value(data))
+    crc = 0
+    with memoryview(data) as view, view.cast("B") as byte_view:
+        for start in range(0, len(byte_view), _CRC32C_BLOCK_SIZE):
+            crc = google_crc32c.extend(crc, byte_view[start : start + _CRC32C_BLOCK_SIZE].tobytes())
+    return int(crc)
+
+
+def _get_remaining_size(fp: IO[bytes]) -> Optional[int]:
+    # The number of bytes left to read from `fp`, if it can be determined without reading.
+    try:
+        if not fp.seekable():
+            return None
+        position = fp.tell()
+        end = fp.seek(0, os.SEEK_END)
+        fp.seek(position)
+    except (OSError, AttributeError, ValueError):  # pragma: no cover
+        return None
+    return max(0, end - position)
+
+
+def _fadvise(fd: int, offset: int, length: int, advice_name: str) -> bool:
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+    except (OSError, AttributeError):  # pragma: no cover
+        return False
+    return True
+
+
+def _get_body(chunk: Buffer) -> Union[bytes, bytearray]:
+    # botocore does not accept memoryviews as a `Body`,
+    # so pass a view spanning a whole buffer as the buffer itself, and copy otherwise.
+    if isinstance(chunk, memoryview):
+        if isinstance(chunk.obj, (bytes, bytearray)) and chunk.nbytes == len(chunk.obj):
+            return chunk.obj
+        return chunk.tobytes()
+    return chunk
+
+
+class _ReadAhead(Generic[T]):
+    """
+    Consume `items` in a separate thread, keeping up to `size` items ready to be iterated over.
+
+    Exceptions raised while consuming `items` are reraised in the iterating thread.
+    """
+
+    def __init__(self, items: Iterator[T], size: int, stop: Optional[threading.Event] = None) -> None:
+        """
+        :param items: The items to consume.
+        :param size: Number of items to keep ready.
+        :param stop: An event that stops the consuming when set; `items` may also watch it.
+        """
+        self.stop = stop or threading.Event()
+        self._ready: queue.Queue[Tuple[bool, Any]] = queue.Queue(maxsize=max(1, size))
+        self._thread = threading.Thread(
+            target=_feed_queue,
+            args=(items, self._ready, self.stop),
+            name="read-ahead",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[T]:
+        while True:
+            is_item, value = self._ready.get()
+            if not is_item:
+                if value is not None:
+                    raise value
+                return
+            yield value
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop consuming `items`, and wait (for up to `timeout` seconds) for the consuming thread to finish.
+        """
+        self.stop.set()
+        self._thread.join(timeout)
+
+
+def _feed_queue(items: Iterator[Any], ready: "queue.Queue[Tuple[bool, Any]]", stop: threading.Event) -> None:
+    # Queue up `(True, item)` for each item, then `(False, None)`, or `(False, exception)` on failure.
+    # Gives up as soon as `stop` is set.
+    def put(entry: Tuple[bool, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in items:
+            if not put((True, item)):
+                return
+        put((False, None))
+    except BaseException as exc:
+        put((False, exc))
@@ -1,42 +1,101 @@
-from typing import Any, Callable, Dict, Optional, Set
+from typing import AbstractSet, Any, Callable, Dict, List, Optional, Tuple
 
 DICT_NAME = "_event_emitter_dict"
+RESOLVED_DICT_NAME = "_event_emitter_resolved_dict"
 
 Handler = Callable[..., Any]
 
 
-def _get_event_emitter_dict(obj: Any) -> Dict[str, Any]:
+def _get_event_emitter_dict(obj: Any) -> Dict[str, List[Handler]]:
     return obj.__dict__.setdefault(DICT_NAME, {})  # type: ignore[no-any-return]
 
 
+def _get_resolved_handlers(obj: Any, event: str) -> Tuple[Handler, ...]:
+    """
+    Get the handlers to call for `event` (including catch-all handlers).
+
+    The result is cached until handlers are next added or removed.
+    """
+    resolved_dict: Dict[str, Tuple[Handler, ...]] = obj.__dict__.setdefault(RESOLVED_DICT_NAME, {})
+    handlers = resolved_dict.get(event)
+    if handlers is None:
+        emitter_dict = _get_event_emitter_dict(obj)
+        # A handler registered both for this event and "*" is only called once.
+        handlers = tuple(dict.fromkeys([*emitter_dict.get(event, ()), *emitter_dict.get("*", ())]))
+        resolved_dict[event] = handlers
+    return handlers
+
+
+def _invalidate_resolved_handlers(obj: Any) -> None:
+    # Catch-all handlers affect every event, so just drop the whole cache.
+    obj.__dict__.pop(RESOLVED_DICT_NAME, None)
+
+
 class EventEmitter:
-    event_types: Set[str] = set()
+    """
+    Mixin for objects that emit events to registered handlers.
+
+    Subclasses declare the events they may emit as a frozenset, e.g.
+    `event_types = frozenset({"progress", "part-error"})`.
+    Handlers are called in the order they were registered.
+    """
+
+    event_types: AbstractSet[str] = frozenset()
+    _has_listener = False
 
     def on(self, event: str, handler: Handler) -> None:
         if event != "*" and event not in self.event_types:
             raise ValueError(f"event type {event} is not known")
 
-        _get_event_emitter_dict(self).setdefault(event, set()).add(handler)
+        handlers = _get_event_emitter_dict(self).setdefault(event, [])
+        if handler not in handlers:
+            handlers.append(handler)
+            _invalidate_resolved_handlers(self)
+            self._has_listener = True
 
     def off(self, event: str, handler: Handler) -> None:
-        _get_event_emitter_dict(self).get(event, set()).discard(handler)
+        handlers = _get_event_emitter_dict(self).get(event, [])
+        if handler in handlers:
+            handlers.remove(handler)
+            _invalidate_resolved_handlers(self)
+            self._has_listener = any(_get_event_emitter_dict(self).values())
 
     def emit(
         self,
         event: str,
         args: Optional[Dict[str, Any]] = None,
         quiet: bool = True,
+        **kwargs: Any,
     ) -> None:
-        if event not in self.event_types:
+        """
+        Call the handlers for `event`.
+
+        Handlers receive `sender` and `event` keyword arguments, along with the event's arguments.
+
+        :param event: Event type.
+        :param args: Dict of event arguments. (Prefer passing them as keyword arguments.)
+        :param quiet: Whether to ignore exceptions raised by handlers.
+        :param kwargs: Event arguments.
+        """
+        # Validating the event type is only a development aid, so `python -O` skips it.
+        if __debug__ and event not in self.event_types:
             raise ValueError(f"event type {event} is not known")
-        emitter_dict = _get_event_emitter_dict(self)
-        handlers = emitter_dict.get(event, set()) | emitter_dict.get("*", set())
-        args = args or {}
-        args.setdefault("sender", self)
-        args.setdefault("event", event)
+        if not self._has_listener:  # Most emitters never get any handlers; keep emitting cheap for them
+            return
+        handlers = _get_resolved_handlers(self, event)
+        if not handlers:
+            return
+        if args is not None:
+            args.update(kwargs)
+            args.setdefault("sender", self)
+            args.setdefault("event", event)
+            kwargs = args
+        else:
+            kwargs["sender"] = self
+            kwargs["event"] = event
         for handler in handlers:
             try:
-                handler(**args)
+                handler(**kwargs)
             except:  # noqa
                 if not quiet:
                     raise
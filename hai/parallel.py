@@ -1,9 +1,13 @@
+import functools
+import itertools
 import os
 import threading
 import time
-from multiprocessing.pool import ApplyResult, ThreadPool
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar
-from weakref import WeakSet
+import warnings
+import weakref
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as wait_futures
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type, TypeVar
 
 
 class ParallelException(Exception):
@@ -14,8 +18,8 @@ class TaskFailed(ParallelException):
     def __init__(
         self,
         message: str,
-        task: "ApplyResult[Any]",
-        exception: Exception,
+        task: "Future[Any]",
+        exception: BaseException,
     ) -> None:
         super().__init__(message)
         self.task = task
@@ -24,7 +28,7 @@ class TaskFailed(ParallelException):
 
 
 class TasksFailed(ParallelException):
-    def __init__(self, message: str, exception_map: Dict[str, Exception]) -> None:
+    def __init__(self, message: str, exception_map: Dict[str, BaseException]) -> None:
         super().__init__(message)
         self.exception_map = exception_map
 
@@ -38,15 +42,34 @@ ParallelRunType = TypeVar("ParallelRunType", bound="BaseParallelRun")
 
 
 class BaseParallelRun:
-    pool: ThreadPool
+    pool: ThreadPoolExecutor
+    inline_threshold = 0
 
     def __init__(self) -> None:
-        self.task_complete_event = threading.Event()
-        self.tasks: List[ApplyResult[Any]] = []
-        self.completed_tasks: WeakSet[ApplyResult[Any]] = WeakSet()
-
-    def _set_task_complete_event(self, value: Any = None) -> None:
-        self.task_complete_event.set()
+        self.task_complete_cond = threading.Condition()
+        self.finished_task_count = 0
+        self.tasks: List[Future[Any]] = []
+        self.completed_tasks: Set[Future[Any]] = set()
+        # The following are maintained by `_on_task_complete`, guarded by `task_complete_cond`.
+        self._pending: Set[Future[Any]] = set()
+        self._failed_tasks: List[Future[Any]] = []
+        self._finished_values: Dict[str, Any] = {}
+        self._finished_exceptions: Dict[str, BaseException] = {}
+
+    def _on_task_complete(self, task: "Future[Any]") -> None:
+        name = task.name  # type: ignore[attr-defined]
+        exc = _get_exception(task)
+        with self.task_complete_cond:
+            self._pending.discard(task)
+            self.completed_tasks.add(task)
+            if exc is not None:
+                self._failed_tasks.append(task)
+                self._finished_exceptions[name] = exc
+                self._finished_values[name] = exc
+            else:
+                self._finished_values[name] = task.result()
+            self.finished_task_count += 1
+            self.task_complete_cond.notify_all()
 
     def add_task(
         self,
@@ -54,7 +77,7 @@ class BaseParallelRun:
         name: Optional[str] = None,
         args: Tuple[Any, ...] = (),
         kwargs: Optional[Dict[str, Any]] = None,
-    ) -> "ApplyResult[RT]":
+    ) -> "Future[RT]":
         """
         Begin running a function (in a secondary thread).
 
@@ -64,32 +87,82 @@ class BaseParallelRun:
         :param args: Positional arguments, if any.
         :param kwargs: Keyword arguments, if any.
         """
-        if not name:
-            name = getattr(task, "__name__" or None) or str(task)  # type: ignore[arg-type]
-        p_task = self.pool.apply_async(
-            task,
-            args=args,
-            kwds=(kwargs or {}),
-            callback=self._set_task_complete_event,
-            error_callback=self._set_task_complete_event,
-        )
-        setattr(p_task, "name", str(name))  # noqa: B010
-        self.tasks.append(p_task)
-
-        # Clear completed tasks, in case someone calls `add_task`
-        # while `.wait()` is in progress.  This will of course cause `.wait()`
-        # to have to do some extra work, but that's fine.
-        self.completed_tasks.clear()
-
+        if len(self.tasks) < self.inline_threshold:
+            p_task: Future[RT] = Future()
+            # Only capture errors, not e.g. KeyboardInterrupts, when running in the caller's thread.
+            _run_future(p_task, task, args, kwargs or {}, catch=Exception)
+        else:
+            p_task = self._submit(task, args, kwargs or {})
+        setattr(p_task, "name", str(name or _get_task_name(task)))  # noqa: B010
+        self._track_tasks([p_task])
         return p_task
 
+    def add_tasks(
+        self,
+        task: Callable[[Any], RT],
+        items: Iterable[Any],
+        chunksize: Optional[int] = None,
+        name_fn: Optional[Callable[[Any], str]] = None,
+    ) -> List["Future[RT]"]:
+        """
+        Begin running a function (in secondary threads) once for each of the given items.
+
+        Each item is a task of its own (with its own name, return value or exception),
+        but items are handed to the thread pool `chunksize` at a time, which amortizes
+        the dispatch overhead when there are many small tasks.
+
+        :param task: The function to run. It is called with each item as its sole argument.
+        :param items: The items to run the function for.
+        :param chunksize: Number of items to run in a single thread pool job. By default, the items are
+                          split so each of the pool's threads gets about 4 jobs, so few items still run in parallel.
+        :param name_fn: A function to derive each task's name from its item.
+                        By default, the function's name and the item's index are used.
+        :return: The tasks' futures, in the order of the items.
+        """
+        base_name = _get_task_name(task)
+        task_items: List[Tuple[Future[RT], Any]] = []
+        for index, item in enumerate(items):
+            future: Future[RT] = Future()
+            setattr(future, "name", str(name_fn(item) if name_fn else f"{base_name}_{index}"))  # noqa: B010
+            task_items.append((future, item))
+        futures = [future for future, item in task_items]
+        self._track_tasks(futures)
+        if chunksize is None:
+            max_workers = int(getattr(self.pool, "_max_workers", 1))
+            chunksize = -(-len(task_items) // (4 * max_workers))
+        chunksize = max(1, chunksize)
+        for start in range(0, len(task_items), chunksize):
+            try:
+                self._submit_batch(task, task_items[start : start + chunksize])
+            except BaseException:
+                # E.g. the pool has been shut down; don't leave the unsubmitted tasks pending forever.
+                for future, _item in task_items[start:]:
+                    future.cancel()
+                raise
+        return futures
+
+    def _submit(self, task: Callable[..., RT], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> "Future[RT]":
+        return self.pool.submit(task, *args, **kwargs)
+
+    def _submit_batch(self, task: Callable[[Any], RT], batch: List[Tuple["Future[RT]", Any]]) -> None:
+        self.pool.submit(_run_batch, task, batch)
+
+    def _track_tasks(self, tasks: List["Future[Any]"]) -> None:
+        with self.task_complete_cond:
+            self.tasks.extend(tasks)
+            self._pending.update(tasks)
+        for task in tasks:
+            # If the task is already done, this calls the callback right away.
+            task.add_done_callback(self._on_task_complete)
+
     def wait(
         self,
         fail_fast: bool = True,
         interval: float = 0.5,
         callback: Optional[Callable[[ParallelRunType], None]] = None,
         max_wait: Optional[float] = None,
-    ) -> List["ApplyResult[Any]"]:
+        raise_on_failure: bool = False,
+    ) -> List["Future[Any]"]:
         """
         Wait until all of the current tasks have finished,
         or until `max_wait` seconds (if set) has been waited for.
@@ -101,7 +174,9 @@ class BaseParallelRun:
         :param fail_fast: Whether to abort the `wait` as
                           soon as a task crashes.
 
-        :param interval: Loop sleep interval.
+        :param interval: Maximum time to sleep between callback calls when no task completes.
+                         Task completions wake the wait immediately, so without a callback
+                         the wait doesn't need to wake up periodically at all.
 
         :param callback: A function that is called on each wait loop iteration.
                          Receives one parameter, the parallel run
@@ -109,23 +184,26 @@ class BaseParallelRun:
 
         :param max_wait: Maximum wait time, in seconds. Infinity if not set or zero.
 
+        :param raise_on_failure: Whether to raise a `TasksFailed` once all tasks have finished,
+                                 if any of them crashed (like `maybe_raise()` does).
+
         :raises TaskFailed: If any task crashes (only when fail_fast is true).
+        :raises TasksFailed: If any task crashed (only when raise_on_failure is true).
         :raises TimeoutError: If max_wait seconds have elapsed.
         """
 
-        # Keep track of tasks we've certifiably seen completed,
-        # to avoid having to acquire a lock for the `ready` event
-        # when we don't need to.
-        self.completed_tasks.clear()
-
         start_time = time.time()
 
         while True:
             if max_wait:
                 waited_for = time.time() - start_time
-                if waited_for > max_wait:
+                if waited_for >= max_wait:
                     raise TimeoutError(f"Waited for {waited_for}/{max_wait} seconds.")
 
+            # Snapshot the completion counter before checking the tasks,
+            # so completions that happen while we're checking will not be slept through.
+            seen_finished_task_count = self.finished_task_count
+
             had_any_incomplete_task = self._wait_tick(fail_fast)
 
             if callback:
@@ -135,55 +213,74 @@ class BaseParallelRun:
             if not had_any_incomplete_task:
                 break
 
-            # If the number of completed tasks equals the number of tasks to process,
-            # we're likewise done.
-            if len(self.completed_tasks) == len(self.tasks):
-                break
+            # Rather than just sleeping, run a task in this thread, if possible (see `ChordParallelRun`).
+            if self._run_queued_job_inline():
+                continue
 
-            # Otherwise wait for a bit before trying again (unless a task completes)
-            self.task_complete_event.wait(interval)
-            # Reset the flag in case it had been set
-            self.task_complete_event.clear()
+            # Otherwise sleep until a task completes (or for `interval` at most, for the callback's sake).
+            timeout = interval if callback else None
+            if max_wait:
+                remaining = max(0.0, max_wait - (time.time() - start_time))
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            with self.task_complete_cond:
+                self.task_complete_cond.wait_for(
+                    lambda: self.finished_task_count != seen_finished_task_count,  # noqa: B023
+                    timeout=timeout,
+                )
 
-        return list(
-            self.completed_tasks,
-        )  # We can just as well return the completed tasks.
+        if raise_on_failure:
+            self.maybe_raise()
 
-    def _wait_tick(self, fail_fast: bool) -> bool:
-        # Keep track of whether there were any incomplete tasks this loop.
-        had_any_incomplete_task = False
-        for task in self.tasks:  # :type: ApplyResult
-            # If we've already seen this task completed, don't bother.
-            if task in self.completed_tasks:
-                continue
+        with self.task_complete_cond:  # Tasks may still be completing in other threads
+            return list(self.completed_tasks)  # We can just as well return the completed tasks.
 
-            # Poll the task to see if it's ready.
-            is_ready = task.ready()
+    def _run_queued_job_inline(self) -> bool:
+        # Run one of the tasks that haven't started yet in the calling thread, if the run supports that.
+        # Returns whether a task was run.
+        return False
 
-            if not is_ready:
-                # If it's not yet ready, we need to loop once more,
-                # and we can't check for success now.
-                had_any_incomplete_task = True
-                continue
+    def _wait_tick(self, fail_fast: bool) -> bool:
+        # Return whether there are any incomplete tasks, raising if we're failing fast.
+        with self.task_complete_cond:
+            failed_task = self._failed_tasks[0] if self._failed_tasks else None
+            had_any_incomplete_task = bool(self._pending)
+
+        if fail_fast and failed_task is not None:
+            exc = self._finished_exceptions[failed_task.name]  # type: ignore[attr-defined]
+            message = f"[{failed_task.name}] {str(exc)}"  # type: ignore[attr-defined]
+            raise TaskFailed(
+                message,
+                task=failed_task,
+                exception=exc,
+            ) from exc
+        return had_any_incomplete_task
 
-            # Mark this task as completed (for good or for worse),
-            # so we don't need to re-check it.
-            self.completed_tasks.add(task)
+    def drain_completed(self) -> List[Tuple[str, Any]]:
+        """
+        Forget about the tasks that have completed so far.
 
-            # Raise an exception if we're failing fast.
-            # We're accessing `_success` directly instead of using
-            # `.successful()` to avoid re-locking (as `.ready()` would).
-            # Similarly, we access `._value` in order to avoid actually
-            # raising the exception directly.
-            if fail_fast and not task._success:  # type: ignore[attr-defined]
-                exc = task._value  # type: ignore[attr-defined]
-                message = f"[{task.name}] {str(exc)}"  # type: ignore[attr-defined]
-                raise TaskFailed(
-                    message,
-                    task=task,
-                    exception=exc,
-                ) from exc
-        return had_any_incomplete_task
+        This is useful for long-lived runs that keep getting new tasks,
+        so the results of old tasks aren't kept in memory indefinitely.
+
+        :return: List of the drained tasks' names and return values (or exceptions), in the order they were added.
+        """
+        with self.task_complete_cond:
+            drained = self._get_completed_tasks()
+            if not drained:
+                return []
+            self.tasks = [task for task in self.tasks if task not in self.completed_tasks]
+            self.completed_tasks.clear()
+            self._failed_tasks.clear()
+            for task in drained:
+                self._finished_values.pop(task.name, None)  # type: ignore[attr-defined]
+                self._finished_exceptions.pop(task.name, None)  # type: ignore[attr-defined]
+        return [(task.name, _get_exception(task) or task.result()) for task in drained]  # type: ignore[attr-defined]
+
+    def clear(self) -> None:
+        """
+        Forget about the tasks that have completed so far, discarding their results.
+        """
+        self.drain_completed()
 
     def maybe_raise(self) -> None:
         """
@@ -203,34 +300,116 @@ class BaseParallelRun:
         Get the return values (if resolved yet) of the tasks.
         :return: dictionary of name to return value.
         """
-        return {t.name: t._value for t in self.tasks if t.ready()}  # type: ignore[attr-defined]
+        with self.task_complete_cond:
+            return dict(self._finished_values)
 
     @property
-    def exceptions(self) -> Dict[str, Exception]:
+    def exceptions(self) -> Dict[str, BaseException]:
         """
         Get the exceptions (if any) of the tasks.
 
         :return: dictionary of task name to exception.
         """
-        return {
-            t.name: t._value  # type: ignore[attr-defined]
-            for t in self.tasks
-            if t.ready() and not t._success  # type: ignore[attr-defined]
-        }
+        with self.task_complete_cond:
+            return dict(self._finished_exceptions)
+
+    def iter_return_values(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over the names and return values (or exceptions) of the tasks completed so far,
+        without building a dict like `return_values` does.
+        """
+        for task in self._get_completed_tasks():
+            exc = _get_exception(task)
+            yield (task.name, exc if exc is not None else task.result())  # type: ignore[attr-defined]
+
+    def iter_exceptions(self) -> Iterator[Tuple[str, BaseException]]:
+        """
+        Iterate over the names and exceptions of the tasks that have failed so far,
+        without building a dict like `exceptions` does.
+        """
+        for task in self._get_completed_tasks():
+            exc = _get_exception(task)
+            if exc is not None:
+                yield (task.name, exc)  # type: ignore[attr-defined]
+
+    def as_completed(self, timeout: Optional[float] = None) -> Iterator["Future[Any]"]:
+        """
+        Iterate over the current tasks as they complete (like `concurrent.futures.as_completed`).
+
+        :param timeout: Maximum time to wait for all tasks, in seconds.
+        :raises TimeoutError: (from `concurrent.futures`) if the timeout elapses.
+        """
+        with self.task_complete_cond:
+            tasks = list(self.tasks)
+        return as_completed(tasks, timeout=timeout)
+
+    def _get_completed_tasks(self) -> List["Future[Any]"]:
+        # In the order they were added.
+        with self.task_complete_cond:
+            return [task for task in self.tasks if task in self.completed_tasks]
 
 
 class ChordParallelRun(BaseParallelRun):
     """Parallel run that inherits the thread pool from another parallel run
     instead of managing its own
+
+    Chords are typically waited for by tasks running in that same pool.
+    If all of the pool's threads were busy doing that, the chord's tasks would
+    never get to run, so when called from one of the pool's threads, `wait()`
+    runs the chord's tasks that haven't been picked up by the pool yet in that thread.
     """
 
     def __init__(self, main_run: "ParallelRun") -> None:
         super().__init__()
         self.main_run = main_run
         self.pool = main_run.pool
+        # Jobs queued to the pool that haven't started yet, guarded by `task_complete_cond`.
+        # Whichever gets to a job first, a pool thread or `_run_queued_job_inline()`, runs it.
+        # Jobs are called with the exception type to capture into the task futures.
+        self._queued_jobs: Dict[int, Callable[[Type[BaseException]], None]] = {}
+        self._job_counter = itertools.count()
+        self._pool_marker = main_run._pool_marker
+
+    def _submit(self, task: Callable[..., RT], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> "Future[RT]":
+        future: Future[RT] = Future()
+        self._queue_job(functools.partial(_run_future, future, task, args, kwargs))
+        return future
+
+    def _submit_batch(self, task: Callable[[Any], RT], batch: List[Tuple["Future[RT]", Any]]) -> None:
+        self._queue_job(functools.partial(_run_batch, task, batch))
+
+    def _queue_job(self, job: Callable[[Type[BaseException]], None]) -> None:
+        with self.task_complete_cond:
+            job_id = next(self._job_counter)
+            self._queued_jobs[job_id] = job
+        try:
+            self.pool.submit(self._run_queued_job, job_id)
+        except BaseException:
+            with self.task_complete_cond:
+                self._queued_jobs.pop(job_id, None)
+            raise
+
+    def _run_queued_job(self, job_id: int) -> None:
+        with self.task_complete_cond:
+            job = self._queued_jobs.pop(job_id, None)
+        if job is not None:
+            job(BaseException)  # Same as `ThreadPoolExecutor` workers
+
+    def _run_queued_job_inline(self) -> bool:
+        # Only run tasks in the pool's own threads, which could otherwise deadlock waiting for them;
+        # elsewhere, it's better to let the pool run the tasks in parallel.
+        if not _in_pool_thread(self._pool_marker):
+            return False
+        with self.task_complete_cond:
+            if not self._queued_jobs:
+                return False
+            job = self._queued_jobs.pop(next(iter(self._queued_jobs)))  # The oldest one
+        job(Exception)  # Let e.g. KeyboardInterrupts propagate in the caller's thread
+        return True
 
     def ready(self) -> bool:
-        return all(t.ready() for t in self.tasks)
+        with self.task_complete_cond:
+            return not self._pending
 
 
 class ParallelRun(BaseParallelRun):
@@ -240,15 +419,48 @@ class ParallelRun(BaseParallelRun):
     Due to the GIL, this is mainly useful for IO-bound threads, such as
     downloading stuff from the Internet, or writing big buffers of data.
 
-    It's recommended to use this in a `with` block, to ensure the thread pool
-    gets properly shut down.
+    By default, runs share a thread pool, so creating a ParallelRun per batch
+    of work is cheap; pass `owned=True` (or a `parallelism`) for a private pool.
+
+    Use this in a `with` block: on a clean exit, the thread pool (if private) is shut down
+    after the remaining tasks finish; if an exception escapes the block, tasks
+    that haven't started yet are cancelled first. (Using a ParallelRun outside
+    a `with` block, without calling `close()` or `terminate()`, is deprecated.)
     """
 
-    def __init__(self, parallelism: Optional[int] = None) -> None:
+    def __init__(
+        self,
+        parallelism: Optional[int] = None,
+        owned: bool = False,
+        inline_threshold: int = 0,
+    ) -> None:
+        """
+        :param parallelism: Number of threads in a private thread pool for this run.
+                            Pools default to the number of usable CPUs times the
+                            `HAI_PARALLELISM_MULT` environment variable (default 2).
+        :param owned: Whether to use a private thread pool even if `parallelism` is not set.
+        :param inline_threshold: Run this many first tasks synchronously within `add_task`
+                                 instead of the thread pool; for tiny workloads, dispatching
+                                 to threads may cost more than the tasks themselves.
+        """
         super().__init__()
-        self.pool = ThreadPool(
-            processes=(parallelism or (int(os.cpu_count() or 1) * 2)),
-        )
+        self.inline_threshold = inline_threshold
+        shared_pool = None if (owned or parallelism) else _get_shared_pool()
+        self._owns_pool = shared_pool is None
+        self._finalizer: Optional[weakref.finalize] = None
+        if shared_pool is None:
+            self._pool_marker = object()
+            self.pool = ThreadPoolExecutor(
+                max_workers=(parallelism or _get_default_parallelism()),
+                thread_name_prefix=self.__class__.__name__,
+                initializer=_mark_pool_thread,
+                initargs=(self._pool_marker,),
+            )
+            # Last-resort cleanup for runs that are never closed; unlike `__del__`, this doesn't keep `self` alive.
+            self._finalizer = weakref.finalize(self, _shutdown_pool, self.pool)
+        else:
+            self._pool_marker = _shared_pool_marker
+            self.pool = shared_pool
 
     def chord(self) -> ChordParallelRun:
         """Return a ChordParallelRun that can run a separate set of tasks using
@@ -260,8 +472,10 @@ class ParallelRun(BaseParallelRun):
         to complete. Instead, call the wait() method on each ChordParallelRun separately
         to wait for that chord to complete.
 
-        Exiting this ParallelRun will terminate the thread pool even if there are
-        incomplete chords.
+        Chord tasks run in this ParallelRun's thread pool. If the pool is private, exiting
+        this ParallelRun shuts it down only after all queued chord tasks have run (even if an
+        exception escapes the `with` block; only this run's own tasks are cancelled then).
+        The shared pool is never shut down, and exiting doesn't wait for incomplete chords.
         """
         return ChordParallelRun(main_run=self)
 
@@ -269,9 +483,144 @@ class ParallelRun(BaseParallelRun):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:  # type: ignore[no-untyped-def]
-        self.pool.terminate()
+        if exc_type:
+            self.terminate()
+        else:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Wait for all tasks to finish, and shut down the thread pool (unless it's shared).
+        """
+        if self._owns_pool:
+            self._detach_finalizer()
+            self.pool.shutdown(wait=True)
+        else:
+            wait_futures(self.tasks)
+
+    def terminate(self, wait: bool = True) -> None:
+        """
+        Cancel all tasks that haven't started yet and shut down the thread pool (unless it's shared).
+
+        :param wait: Whether to wait for already running tasks to finish.
+        """
+        for task in self.tasks:
+            task.cancel()
+        if self._owns_pool:
+            self._detach_finalizer()
+            self.pool.shutdown(wait=wait)
+        elif wait:
+            wait_futures(self.tasks)
 
-    def __del__(self) -> None:  # opportunistic cleanup
-        if self.pool:
-            self.pool.terminate()
-            self.pool = None  # type: ignore[assignment]
+    def _detach_finalizer(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+
+
+_shared_pool: Optional[ThreadPoolExecutor] = None
+_shared_pool_lock = threading.Lock()
+_shared_pool_marker = object()
+_pool_thread_state = threading.local()
+
+
+def _shutdown_pool(pool: ThreadPoolExecutor) -> None:
+    # Called by a finalizer, possibly during interpreter shutdown, so don't make noise.
+    try:
+        pool.shutdown(wait=False)
+    except Exception:  # pragma: no cover
+        pass
+
+
+def _get_default_parallelism() -> int:
+    # The CPUs we may actually run on (e.g. in a container) may be fewer than there are.
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on all platforms
+        cpu_count = int(os.cpu_count() or 1)
+    multiplier_value = os.environ.get("HAI_PARALLELISM_MULT", "2")
+    try:
+        multiplier = int(multiplier_value)
+    except ValueError:
+        warnings.warn(f"Invalid HAI_PARALLELISM_MULT value {multiplier_value!r}; using 2", stacklevel=2)
+        multiplier = 2
+    return max(1, cpu_count * multiplier)
+
+
+def _mark_pool_thread(pool_marker: object) -> None:
+    # Thread pool initializer, so `_in_pool_thread` can tell which pool (if any) a thread belongs to.
+    _pool_thread_state.pool_marker = pool_marker
+
+
+def _in_pool_thread(pool_marker: object) -> bool:
+    return getattr(_pool_thread_state, "pool_marker", None) is pool_marker
+
+
+def _get_shared_pool() -> Optional[ThreadPoolExecutor]:
+    """
+    Get the thread pool shared by ParallelRuns, creating it if necessary.
+
+    Returns None when called from one of the shared pool's own threads,
+    since a task waiting for tasks queued to its own pool could deadlock it.
+    """
+    global _shared_pool
+    if _in_pool_thread(_shared_pool_marker):
+        return None
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ThreadPoolExecutor(
+                max_workers=_get_default_parallelism(),
+                thread_name_prefix="ParallelRun-shared",
+                initializer=_mark_pool_thread,
+                initargs=(_shared_pool_marker,),
+            )
+        return _shared_pool
+
+
+def _get_task_name(task: Callable[..., Any]) -> str:
+    try:
+        return str(task.__name__)
+    except AttributeError:  # e.g. `functools.partial` objects
+        return str(task)
+
+
+def _run_batch(
+    task: Callable[[Any], RT],
+    batch: List[Tuple["Future[RT]", Any]],
+    catch: Type[BaseException] = BaseException,
+) -> None:
+    for index, (future, item) in enumerate(batch):
+        try:
+            _run_future(future, task, (item,), {}, catch=catch)
+        except BaseException:
+            for rest_future, _item in batch[index + 1 :]:
+                rest_future.cancel()
+            raise
+
+
+def _run_future(
+    future: "Future[RT]",
+    task: Callable[..., RT],
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+    catch: Type[BaseException] = BaseException,
+) -> None:
+    # Run `task` to resolve a future created outside the thread pool.
+    # Exceptions that aren't of the `catch` type are also reraised after being set on the future.
+    if not future.set_running_or_notify_cancel():  # Cancelled before it got to run
+        return
+    try:
+        result = task(*args, **kwargs)
+    except BaseException as exc:
+        future.set_exception(exc)
+        if not isinstance(exc, catch):
+            raise
+    else:
+        future.set_result(result)
+
+
+def _get_exception(task: "Future[Any]") -> Optional[BaseException]:
+    # Like `task.exception()` for a done task, but returns (instead of raising) cancellation errors.
+    if task.cancelled():
+        return CancelledError()
+    return task.exception()
@@ -1,7 +1,8 @@
-import re
+import os
 import selectors
 import threading
-from typing import IO, Callable, Dict, List, Optional, Tuple
+import weakref
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
 
 
 class BasePipePump:
@@ -9,23 +10,37 @@ class BasePipePump:
     Pump file objects into buffers.
     """
 
-    read_size = 1024
+    # Reads return whatever is available (up to this), so this is sized to fit a full
+    # (Linux) pipe buffer: a single read drains a ready pipe, instead of needing a `select` per KiB.
+    read_size = 65536
 
     def __init__(self) -> None:
         self.selector = selectors.DefaultSelector()
-        self.buffers: Dict[str, bytes] = {}
+        self.buffers: Dict[str, bytearray] = {}
         self.selector_lock = threading.Lock()
-
-    def register(self, key: str, fileobj: Optional[IO[bytes]]) -> None:
+        # Held while feeding data (and thus calling handlers), so the selector isn't locked meanwhile.
+        self.feed_lock = threading.RLock()
+        self._closing = False
+        # Written to when closing, to wake up a pump thread waiting in `select`.
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            os.set_blocking(fd, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, data=None)
+        self._close_wake_pipe = weakref.finalize(self, _close_fds, self._wake_r, self._wake_w)
+
+    def register(self, key: str, fileobj: Optional[Union[int, IO[bytes]]]) -> None:
         """
         Register a file object to be polled by `pump`.
 
+        Data is read directly from the underlying file descriptor, bypassing any buffering
+        in the file object (so e.g. subprocess pipes should be opened with `bufsize=0`).
+
         :param key: Queue key string.
-        :param fileobj: File object to poll.
+        :param fileobj: File object (or file descriptor) to poll.
         """
         key = str(key)
-        self.buffers[key] = b""
-        if fileobj:
+        self.buffers[key] = bytearray()
+        if fileobj is not None:
             self.selector.register(fileobj, selectors.EVENT_READ, data=key)
 
     def pump(self, timeout: float = 0, max_reads: int = 1) -> int:
@@ -40,21 +55,46 @@ class BasePipePump:
         :return: The number of read attempts done.
         """
         read_num = 0
-        with self.selector_lock:
-            if not self.selector:  # pragma: no cover
-                return 0
-            while read_num < max_reads:
-                read_num += 1
-                should_repeat = False
-                for key, _event in self.selector.select(timeout=timeout):
-                    fileobj: IO[bytes] = key.fileobj  # type: ignore[assignment]
-                    data = fileobj.read(self.read_size)
-                    self.feed(key.data, data)
-                    should_repeat = True  # Got data, should try again
-                if not should_repeat:
+        while read_num < max_reads:
+            with self.selector_lock:
+                if not self.selector:  # pragma: no cover
                     break
+                read_num += 1
+                reads = self._read_ready(timeout)
+                # Take the feed lock before letting go of the selector lock,
+                # so concurrent pumps feed the data in the order it was read.
+                self.feed_lock.acquire()
+            try:
+                for key, chunks in reads.items():
+                    # Feed all the data read for a key at once.
+                    self.feed(key, b"".join(chunks))
+            finally:
+                self.feed_lock.release()
+            if not reads:  # Nothing to read, no use trying again
+                break
         return read_num
 
+    def _read_ready(self, timeout: float) -> Dict[str, List[bytes]]:
+        # Wait for (at most `timeout`) and read from the ready file descriptors, grouping the data by key.
+        reads: Dict[str, List[bytes]] = {}
+        for key, _event in self.selector.select(timeout=timeout):
+            if key.data is None:  # Woken up by `_stop_pumping`; drain the wake-up pipe so it won't stay readable
+                try:
+                    os.read(key.fd, 4096)
+                except OSError:  # pragma: no cover
+                    pass
+                continue
+            try:
+                # Read whatever is available, without going through (and blocking in) Python's IO layer.
+                data = os.read(key.fd, self.read_size)
+            except BlockingIOError:  # pragma: no cover
+                continue
+            if not data:  # EOF; stop polling the file, as it would stay readable forever
+                self.selector.unregister(key.fileobj)
+                continue
+            reads.setdefault(key.data, []).append(data)
+        return reads
+
     def feed(self, key: str, data: bytes) -> None:
         """
         Add data to the keyed buffer.
@@ -66,32 +106,74 @@ class BasePipePump:
         :param data: Byte data to buffer.
         """
         buffered_data = self.buffers[key]
-        if data:
-            buffered_data += data
-            buffered_data = self._process_buffer(key, buffered_data)
-        self.buffers[key] = buffered_data
-
-    def _process_buffer(self, key: str, buffer: bytes) -> bytes:  # pragma: no cover
+        if not data:
+            return
+        if not buffered_data:
+            # Reads often hold complete items, so process them as-is and only buffer any leftovers.
+            consumed = self._get_consumed(data, self._process_buffer(key, data))
+            if consumed < len(data):
+                buffered_data += memoryview(data)[consumed:]
+            return
+        # Buffers are extended and trimmed in place, so data isn't copied around on every read.
+        buffered_data += data
+        consumed = self._get_consumed(buffered_data, self._process_buffer(key, buffered_data))
+        if consumed:
+            del buffered_data[:consumed]
+
+    def _process_buffer(self, key: str, buffer: bytes) -> Union[int, bytes]:  # pragma: no cover
         """
-        Internal; process a given buffer somehow and return what should be left
-        in the internal buffer.
+        Internal; process a given buffer somehow and return how many bytes from its start
+        were consumed; the rest is left in the internal buffer.
+
+        The buffer may be mutable; it must not be modified, nor retained past the call.
+
+        Returning the unconsumed tail of the buffer (as bytes), as overrides written for
+        earlier versions do, is still supported, but costs a copy of the tail on every read.
 
         See `LinePipePump` for a concrete idea on how to use this.
 
         :param key:
         :param buffer:
-        :return:
+        :return: Number of bytes consumed, or the unconsumed bytes.
         """
-        return buffer
+        return 0
+
+    @staticmethod
+    def _get_consumed(buffer: bytes, result: Union[int, bytes]) -> int:
+        # Convert a `_process_buffer` return value into the number of bytes consumed.
+        if isinstance(result, int):
+            return result
+        return len(buffer) - len(result)
 
     def close(self) -> None:
         self.close_selector()
 
+    def _flush_buffers(self, handle: Callable[[str, bytes], None]) -> None:
+        # Hand off (and forget) whatever is left in the buffers, e.g. unfinished lines when closing.
+        with self.feed_lock:
+            for key, buffer in self.buffers.items():
+                if buffer:  # pragma: no branch
+                    handle(key, bytes(buffer))
+            self.buffers.clear()
+
     def close_selector(self) -> None:
         if self.selector:  # pragma: no branch
+            self._stop_pumping()
             with self.selector_lock:
                 self.selector.close()
             self.selector = None  # type: ignore[assignment]
+            self._close_wake_pipe()
+
+    def _stop_pumping(self) -> None:
+        # Stop `as_thread` threads, waking them up right away if they're waiting for data
+        # (and holding the selector lock).
+        self._closing = True
+        if not self._close_wake_pipe.alive:  # Already closed (and the fd number may have been reused)
+            return
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:  # pragma: no cover
+            pass
 
     def as_thread(self, interval: float = 0.05) -> threading.Thread:
         """
@@ -104,12 +186,17 @@ class BasePipePump:
         """
 
         def pumper() -> None:
-            while self.selector is not None:
+            while self.selector is not None and not self._closing:
                 self.pump(timeout=interval)
 
         return threading.Thread(target=pumper, name=f"Thread for {self!r}")
 
 
+def _close_fds(*fds: int) -> None:
+    for fd in fds:
+        os.close(fd)
+
+
 LineHandler = Callable[[str, List[bytes]], None]
 
 
@@ -119,14 +206,21 @@ class LinePipePump(BasePipePump):
     separated by a given bytestring.
     """
 
-    def __init__(self, separator: bytes = b"\n") -> None:
+    def __init__(self, separator: bytes = b"\n", accumulate_as_bytearray: bool = False) -> None:
         """
         :param separator: Line separator byte sequence.
+        :param accumulate_as_bytearray: Accumulate each key's lines into a single bytearray
+                                        (in `values`) instead of a list of lines (in `lines`).
+                                        This makes `get_value` cheap, but line handlers then only
+                                        receive a list of the new line, and mutating it has no effect.
         """
         super().__init__()
         assert isinstance(separator, bytes)
         self.separator = separator
+        self.accumulate_as_bytearray = accumulate_as_bytearray
         self.lines: Dict[str, List[bytes]] = {}
+        # Lines, each followed by the separator, when `accumulate_as_bytearray` is set.
+        self.values: Dict[str, bytearray] = {}
         self._line_handlers: List[LineHandler] = []
 
     def add_line_handler(self, handler: LineHandler) -> None:
@@ -139,11 +233,21 @@ class LinePipePump(BasePipePump):
         assert callable(handler)
         self._line_handlers.append(handler)
 
-    def _process_buffer(self, key: str, buffer: bytes) -> bytes:
-        while self.separator in buffer:
-            line, _, buffer = buffer.partition(self.separator)
-            self.add_line(key, line)
-        return buffer
+    def _process_buffer(self, key: str, buffer: bytes) -> int:
+        separator = self.separator
+        last_separator = buffer.rfind(separator)
+        if last_separator < 0:
+            return 0  # No complete lines; don't copy an unfinished line around
+        # Split everything up to the last separator in one go.
+        # (The split part may end with a partial line only if the separator can overlap itself.)
+        head_length = last_separator + len(separator)
+        with memoryview(buffer) as view:
+            lines = view[:head_length].tobytes().split(separator)
+        tail = lines.pop()
+        add_line = self._get_line_adder()
+        for line in lines:
+            add_line(key, line)
+        return head_length - len(tail)
 
     def add_line(self, key: str, line: bytes) -> None:
         """
@@ -157,8 +261,24 @@ class LinePipePump(BasePipePump):
         key = str(key)
         if not isinstance(line, bytes):
             line = line.encode("utf-8")
-        line_list = self.lines.setdefault(key, [])
-        line_list.append(line)
+        self._add_line(key, line)
+
+    def _get_line_adder(self) -> Callable[[str, bytes], None]:
+        # Subclasses overriding `add_line` expect it to be called.
+        if type(self).add_line is LinePipePump.add_line:
+            return self._add_line
+        return self.add_line
+
+    def _add_line(self, key: str, line: bytes) -> None:
+        # `add_line` without the argument coercion, for lines split by the pump itself.
+        if self.accumulate_as_bytearray:
+            value = self.values.setdefault(key, bytearray())
+            value += line
+            value += self.separator
+            line_list = [line]
+        else:
+            line_list = self.lines.setdefault(key, [])
+            line_list.append(line)
 
         for handler in self._line_handlers:  # pragma: no branch
             handler(key, line_list)
@@ -170,17 +290,22 @@ class LinePipePump(BasePipePump):
         :param key: Line queue key
         :return: bytestring of content
         """
-        return self.separator.join(self.lines.get(str(key), ()))
+        key = str(key)
+        if self.accumulate_as_bytearray:
+            value = self.values.get(key)
+            if not value:
+                return b""
+            with memoryview(value) as view:
+                return view[: -len(self.separator)].tobytes()  # Sans the final separator
+        return self.separator.join(self.lines.get(key, ()))
 
     def close(self) -> None:
         # Flush all buffers when closing; any unfinished lines will thus
         # end up being posted as lines.
+        self._stop_pumping()
         self.pump()  # One more pump before closing!
         super().close()
-        for key, buffer in self.buffers.items():
-            if buffer:  # pragma: no branch
-                self.add_line(key, buffer)
-        self.buffers.clear()
+        self._flush_buffers(self._get_line_adder())
 
 
 ChunkHandler = Callable[[str, bytes], None]
@@ -191,14 +316,18 @@ class ChunkPipePump(BasePipePump):
     A PipePump that hands off read data in chunks of N bytes, then discards it.
     """
 
-    def __init__(self, chunk_size: int = 256) -> None:
+    def __init__(self, chunk_size: int = 256, zero_copy_handlers: bool = False) -> None:
         """
         :param chunk_size: Chunk size in bytes.
                            The final chunk might be shorter than this.
+        :param zero_copy_handlers: Pass handlers memoryviews into the pump's buffer instead of copies of the chunks.
+                                   The views are only valid during the handler call; handlers needing to
+                                   keep the data must copy it (e.g. with `bytes(chunk)`).
         """
         super().__init__()
         assert chunk_size > 0
         self.chunk_size = chunk_size
+        self.zero_copy_handlers = zero_copy_handlers
         self._chunk_handlers = []  # type: List[ChunkHandler]
 
     def add_chunk_handler(self, handler: ChunkHandler) -> None:
@@ -209,23 +338,33 @@ class ChunkPipePump(BasePipePump):
         assert callable(handler)
         self._chunk_handlers.append(handler)
 
-    def _process_buffer(self, key: str, buffer: bytes) -> bytes:
-        while len(buffer) >= self.chunk_size:
-            chunk, buffer = buffer[: self.chunk_size], buffer[self.chunk_size :]
-            self._handle_chunk(key, chunk)
-        return buffer
-
-    def _handle_chunk(self, key: str, chunk: bytes) -> None:
+    def _process_buffer(self, key: str, buffer: bytes) -> int:
+        # Walk the buffer with an offset, so the remainder is never sliced.
+        chunk_size = self.chunk_size
+        zero_copy_handlers = self.zero_copy_handlers
+        handle_chunk = self._handle_chunk
+        offset = 0
+        end = len(buffer) - chunk_size
+        with memoryview(buffer) as view:
+            while offset <= end:
+                chunk_view = view[offset : offset + chunk_size]
+                if zero_copy_handlers:
+                    with chunk_view:  # Released after the handlers, so it can't be used past them
+                        handle_chunk(key, chunk_view)
+                else:
+                    handle_chunk(key, chunk_view.tobytes())
+                offset += chunk_size
+        return offset
+
+    def _handle_chunk(self, key: str, chunk: Union[bytes, memoryview]) -> None:
         for handler in self._chunk_handlers:  # pragma: no branch
             handler(key, chunk)
 
     def close(self) -> None:
+        self._stop_pumping()
         self.pump()  # One more pump before closing!
         super().close()
-        for key, buffer in self.buffers.items():
-            if buffer:  # pragma: no branch
-                self._handle_chunk(key, buffer)
-        self.buffers.clear()
+        self._flush_buffers(self._handle_chunk)
 
 
 CRLFHandler = Callable[[str, Optional[bytes], bytes, bool], None]
@@ -238,8 +377,6 @@ class CRLFPipePump(BasePipePump):
     Unlike LinePipePump, this does not buffer any history in its own state, only the last line.
     """
 
-    CRLF_SEP_RE = re.compile(rb"^(.*?)([\r\n])")
-
     def __init__(self) -> None:
         super().__init__()
         self.line_state: Dict[str, Tuple[Optional[bytes], bool]] = {}
@@ -259,14 +396,24 @@ class CRLFPipePump(BasePipePump):
         assert callable(handler)
         self._handlers.append(handler)
 
-    def _process_buffer(self, key: str, buffer: bytes) -> bytes:
-        while True:
-            m = self.CRLF_SEP_RE.match(buffer)
-            if not m:
-                break
-            self._process_line(key, m.group(1), is_replace=(m.group(2) == b"\r"))
-            buffer = buffer[m.end() :]
-        return buffer
+    def _process_buffer(self, key: str, buffer: bytes) -> int:
+        # Keep track of the next CR and LF separately, so neither is searched for again
+        # before the scan has gone past it.
+        find = buffer.find
+        process_line = self._process_line
+        start = 0
+        next_cr = find(b"\r")
+        next_lf = find(b"\n")
+        while next_cr >= 0 or next_lf >= 0:
+            is_replace = next_lf < 0 or 0 <= next_cr < next_lf
+            end = next_cr if is_replace else next_lf
+            process_line(key, bytes(buffer[start:end]), is_replace)
+            start = end + 1
+            if 0 <= next_cr < start:
+                next_cr = find(b"\r", start)
+            if 0 <= next_lf < start:
+                next_lf = find(b"\n", start)
+        return start
 
     def _process_line(self, key: str, new_content: bytes, is_replace: bool) -> None:
         if key in self.line_state:
@@ -279,9 +426,7 @@ class CRLFPipePump(BasePipePump):
             handler(key, old_content, new_content, last_was_replace)
 
     def close(self) -> None:
+        self._stop_pumping()
         self.pump()  # One more pump before closing!
         super().close()
-        for key, buffer in self.buffers.items():
-            if buffer:  # pragma: no branch
-                self._process_line(key, buffer, False)
-        self.buffers.clear()
+        self._flush_buffers(lambda key, buffer: self._process_line(key, buffer, is_replace=False))
@@ -1,6 +1,7 @@
 import time
+from collections import OrderedDict
 from enum import Enum
-from typing import Dict, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
 
 class StateChange(Enum):
@@ -18,6 +19,14 @@ STATE_CHANGE_MAP = {
     (False, False): StateChange.STILL_THROTTLED,
 }
 
+# The same mapping, indexed by `(did_change << 1) | state`.
+_STATE_CHANGE_TABLE = (
+    StateChange.STILL_THROTTLED,
+    StateChange.STILL_OPEN,
+    StateChange.BECAME_THROTTLED,
+    StateChange.BECAME_OPEN,
+)
+
 
 class Rate:
     __slots__ = ("rate", "period", "rate_per_period")
@@ -46,17 +55,32 @@ class TickResult:
     To find out whether the `.tick()` operation caused the state to change,
     and how, the `.did_change` value can be accessed; to find out the exact
     change state (as a `StateChange` value), it's available as `.state_change`.
+
+    `TickResult`s are immutable, as `RateLimiter.tick()` hands out shared instances.
     """
 
     __slots__ = ("state", "did_change")
 
+    state: bool
+    did_change: bool
+
     def __init__(self, state: bool, did_change: bool) -> None:
-        self.state = bool(state)
-        self.did_change = bool(did_change)
+        object.__setattr__(self, "state", bool(state))
+        object.__setattr__(self, "did_change", bool(did_change))
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self) -> Tuple[Type["TickResult"], Tuple[bool, bool]]:
+        # Copy and unpickle through `__init__`, as the default slot restoring would trip `__setattr__`.
+        return (TickResult, (self.state, self.did_change))
 
     @property
     def state_change(self) -> StateChange:
-        return STATE_CHANGE_MAP[(self.did_change, self.state)]
+        return _STATE_CHANGE_TABLE[(self.did_change << 1) | self.state]
 
     def __bool__(self) -> bool:
         return self.state
@@ -77,10 +101,28 @@ class RateLimiter:
     #: The clock to use for RateLimiters. Should return seconds (or whatever is
     #: the `period` of the RateLimiter) as a floating-point number.
     #: By default, the high-resolution performance counter is used.
-    #: This can be overwritten, or overridden in subclasses.
+    #: This can be overwritten, or overridden in subclasses; it is bound
+    #: when the RateLimiter is constructed.
     clock = time.perf_counter if hasattr(time, "perf_counter") else time.time
 
-    __slots__ = ("rate", "allow_underflow", "last_check", "allowance", "current_state")
+    __slots__ = (
+        "_rate",
+        "_rate_cap",
+        "_rpp",
+        "allow_underflow",
+        "last_check",
+        "allowance",
+        "current_state",
+        "_clock",
+    )
+
+    # The four possible tick results, indexed by `(did_change << 1) | state`.
+    _RESULTS = (
+        TickResult(False, False),
+        TickResult(True, False),
+        TickResult(False, True),
+        TickResult(True, True),
+    )
 
     def __init__(self, rate: Rate, allow_underflow: bool = False) -> None:
         """
@@ -94,6 +136,8 @@ class RateLimiter:
         self.last_check: Optional[float] = None
         self.allowance: Optional[float] = None
         self.current_state: Optional[bool] = None
+        # https://github.com/python/mypy/issues/6910
+        self._clock: Callable[[], float] = self.clock  # type: ignore[misc]
 
     @classmethod
     def from_per_second(
@@ -103,26 +147,32 @@ class RateLimiter:
     ) -> "RateLimiter":
         return cls(rate=Rate(rate=per_second), allow_underflow=allow_underflow)
 
+    @property
+    def rate(self) -> Rate:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: Rate) -> None:
+        # The Rate's values are copied into flat slots for `_tick`.
+        self._rate = rate
+        self._rate_cap = rate.rate
+        self._rpp = rate.rate_per_period
+
     def _tick(self) -> bool:
-        # https://github.com/python/mypy/issues/6910
-        current = self.clock()  # type: float  # type: ignore[misc]
+        current = self._clock()
+        rate_cap = self._rate_cap
 
         if self.current_state is None:
-            self.last_check = current
-            self.allowance = self.rate.rate
-            self.current_state = None
-
-        last_check = self.last_check  # type: float # type: ignore[assignment]
-        time_passed = current - last_check
+            allowance = rate_cap
+        else:
+            allowance = self.allowance + (current - self.last_check) * self._rpp  # type: ignore[operator]
+            if allowance > rate_cap:  # Do not allow allowance to grow unbounded
+                allowance = rate_cap
         self.last_check = current
-        self.allowance += time_passed * self.rate.rate_per_period  # type: ignore[operator]
-        self.allowance = min(
-            self.allowance,
-            self.rate.rate,
-        )  # Do not allow allowance to grow unbounded
-        throttled = self.allowance < 1
+        throttled = allowance < 1
         if self.allow_underflow or not throttled:
-            self.allowance -= 1
+            allowance -= 1
+        self.allowance = allowance
 
         return not throttled
 
@@ -138,15 +188,50 @@ class RateLimiter:
 
         :return: Returns a TickResult; see that class's documentation for information.
         """
+        current_state = self.current_state
         new_state = self._tick()
+        self.current_state = new_state
+        if current_state is None:
+            return self._RESULTS[new_state]
+        return self._RESULTS[((new_state is not current_state) << 1) | new_state]
 
-        if self.current_state is None:
-            self.current_state = new_state
+    def tick_many(self, n: int) -> List[TickResult]:
+        """
+        Tick the rate limiter `n` times at once, i.e. for a burst of events
+        arriving at the same instant.
 
-        did_change = new_state is not self.current_state
-        self.current_state = new_state
+        This is equivalent to, but cheaper than, calling `.tick()` `n` times.
 
-        return TickResult(new_state, did_change)
+        :param n: Number of events.
+        :return: A list of `n` TickResults.
+        """
+        if n <= 0:
+            return []
+        current = self._clock()
+        rate = self._rate_cap
+        state = self.current_state
+        if state is None:
+            allowance = rate
+        else:
+            allowance = self.allowance + (current - self.last_check) * self._rpp  # type: ignore[operator]
+            if allowance > rate:  # Do not allow allowance to grow unbounded
+                allowance = rate
+        allow_underflow = self.allow_underflow
+        results = self._RESULTS
+        out: List[TickResult] = []
+        append = out.append
+        for _ in range(n):
+            new_state = allowance >= 1
+            if allow_underflow or new_state:
+                allowance -= 1
+            if state is None:
+                state = new_state
+            append(results[((new_state is not state) << 1) | new_state])
+            state = new_state
+        self.last_check = current
+        self.allowance = allowance
+        self.current_state = state
+        return out
 
     def __repr__(self) -> str:
         state_text = "throttled" if not self.current_state else "open"
@@ -161,16 +246,32 @@ class MultiRateLimiter:
     rate_limiter_class = RateLimiter
     allow_underflow = False
 
+    #: The maximum number of RateLimiters to keep around; when a new one would
+    #: exceed this, the least recently used one is evicted. None for no limit.
+    max_limiters: Optional[int] = None
+
     def __init__(
         self,
         default_limit: Rate,
         per_name_limits: Optional[Dict[str, Rate]] = None,
+        max_limiters: Optional[int] = None,
     ) -> None:
-        self.limiters: Dict[str, RateLimiter] = {}
+        """
+        :param default_limit: The Rate for names not in `per_name_limits`.
+        :param per_name_limits: Rates for specific names.
+        :param max_limiters: Overrides the `max_limiters` class attribute, if set.
+        """
+        self.limiters: OrderedDict[str, RateLimiter] = OrderedDict()
+        if max_limiters is not None:
+            self.max_limiters = max_limiters
         self.default_limit = default_limit
         self.per_name_limits = dict(per_name_limits or {})
-        assert isinstance(default_limit, Rate)
-        assert all(isinstance(l, Rate) for l in self.per_name_limits.values())
+        if __debug__:
+            if not isinstance(default_limit, Rate):
+                raise TypeError(f"`default_limit` must be a Rate (not {default_limit!r})")
+            for name, limit in self.per_name_limits.items():
+                if not isinstance(limit, Rate):
+                    raise TypeError(f"Limit for {name!r} must be a Rate (not {limit!r})")
 
     def tick(self, name: str) -> TickResult:
         """
@@ -195,14 +296,42 @@ class MultiRateLimiter:
 
         :param name: Name of the limiter.
         """
-        limiter = self.limiters.get(name)
-        if not limiter:
-            limiter = self.limiters[name] = self.rate_limiter_class(
-                rate=self.get_rate(name),
-                allow_underflow=self.allow_underflow,
-            )
+        limiters = self.limiters
+        max_limiters = self.max_limiters
+        try:
+            limiter = limiters[name]
+        except KeyError:
+            pass
+        else:
+            if max_limiters is not None:
+                limiters.move_to_end(name)
+            return limiter
+        if max_limiters is not None:
+            while limiters and len(limiters) >= max_limiters:
+                limiters.popitem(last=False)
+        limiter = limiters[name] = self.rate_limiter_class(
+            rate=self.get_rate(name),
+            allow_underflow=self.allow_underflow,
+        )
         return limiter
 
+    def evict_stale(self, max_age: float) -> int:
+        """
+        Delete named RateLimiters that have not been ticked in `max_age` seconds
+        (or whatever is the `period` of the limiters' clock).
+
+        :param max_age: Maximum time since the last tick.
+        :return: The number of limiters deleted.
+        """
+        stale_names = [
+            name
+            for (name, limiter) in self.limiters.items()
+            if limiter.last_check is None or limiter._clock() - limiter.last_check > max_age
+        ]
+        for name in stale_names:
+            del self.limiters[name]
+        return len(stale_names)
+
     def get_rate(self, name: str) -> Rate:
         """
         Get the RateLimit for a named RateLimiter.
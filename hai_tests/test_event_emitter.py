@@ -24,12 +24,14 @@ def test_event_emitter(omni):
     t.emit("two")
     t.off("one", handle)
     t.emit("one", {"oh": "no"})
+    t.emit("two", oh="yes")
 
     if omni:
         assert events == [
             {"event": "one"},
             {"event": "two"},
             {"event": "one", "oh": "no"},
+            {"event": "two", "oh": "yes"},
         ]
     else:
         assert events == [
@@ -57,3 +59,37 @@ def test_event_emitter_unknown_event_types():
 
     with pytest.raises(ValueError):
         t.emit("hello")
+
+
+def test_event_emitter_handler_changes_after_emit():
+    t = Thing()
+    events = []
+
+    def handle(event, **args):
+        events.append(event)
+
+    t.emit("one")  # No handlers yet
+    t.on("one", handle)
+    t.on("*", handle)  # Registered twice, but should only be called once per event
+    t.emit("one")
+    t.emit("two")
+    t.off("*", handle)
+    t.emit("one")
+    t.emit("two")
+    assert events == ["one", "two", "one"]
+
+
+def test_event_emitter_off_last_handler():
+    t = Thing()
+    events = []
+
+    def handle(event, **args):
+        events.append(event)
+
+    t.on("one", handle)
+    t.emit("one")
+    t.off("one", handle)
+    t.emit("one")
+    t.on("two", handle)
+    t.emit("two")
+    assert events == ["one", "two"]
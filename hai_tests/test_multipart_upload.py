@@ -1,10 +1,18 @@
+import base64
+import threading
+import time
 from io import BytesIO
 
 import boto3
 import pytest
+from botocore.config import Config
 from moto import mock_s3
 
-from hai.boto3_multipart_upload import S3_MINIMUM_MULTIPART_FILE_SIZE, MultipartUploader
+from hai.boto3_multipart_upload import (
+    S3_MINIMUM_MULTIPART_CHUNK_SIZE,
+    S3_MINIMUM_MULTIPART_FILE_SIZE,
+    MultipartUploader,
+)
 
 
 class ChunkCallbackMultipartUploader(MultipartUploader):
@@ -59,7 +67,11 @@ def test_multipart_upload(tmpdir, file_type, mpu_class):
 
     obj = s3.get_object(Bucket=bucket_name, Key=key_name)
     assert obj["ContentLength"] == expected_size
-    assert any(e["event"] == "progress" for e in events)
+    progress_events = [e for e in events if e["event"] == "progress"]
+    assert progress_events[-1]["bytes_uploaded"] == expected_size
+    assert progress_events[-1]["completed_parts"] == len(progress_events)
+    if file_type == "real":
+        assert progress_events[-1]["total_parts"] == len(progress_events)
 
     if mpu_class is ChunkCallbackMultipartUploader:
         assert sum(mpu.chunk_sizes) == expected_size
@@ -95,3 +107,170 @@ def test_error_handling():
     mpu = MultipartUploader(s3)
     with pytest.raises(IOError):
         mpu.upload_parts("foo", "foo", [b"\x00" * S3_MINIMUM_MULTIPART_FILE_SIZE])
+
+
+@mock_s3
+def test_no_reads_while_aborting():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    calls = []
+    original_abort = s3.abort_multipart_upload
+
+    def upload_fn(**args):
+        time.sleep(0.05)
+        raise OSError("the internet is dead")
+
+    def abort_fn(**args):
+        calls.append("abort")
+        time.sleep(0.3)  # Give the read-ahead thread a chance to misbehave
+        return original_abort(**args)
+
+    class ReadTrackingMultipartUploader(MultipartUploader):
+        part_retry_attempts = 1
+
+        def read_chunk_into(self, fp, buffer):
+            calls.append("read")
+            return super().read_chunk_into(fp, buffer)
+
+    s3.upload_part = upload_fn
+    s3.abort_multipart_upload = abort_fn
+    data = b"\xc0" * (S3_MINIMUM_MULTIPART_CHUNK_SIZE * 8)
+    mpu = ReadTrackingMultipartUploader(s3, max_concurrency=1)
+    with pytest.raises(IOError):
+        mpu.upload_file("foo", "foo", BytesIO(data), chunk_size=S3_MINIMUM_MULTIPART_CHUNK_SIZE)
+    assert calls[-1] == "abort"
+
+
+@mock_s3
+def test_concurrency_is_bounded():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    original_upload_part = s3.upload_part
+
+    def upload_fn(**args):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        try:
+            time.sleep(0.05)
+            return original_upload_part(**args)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    s3.upload_part = upload_fn
+    mpu = MultipartUploader(s3, max_concurrency=3)
+    parts = [bytes((n,)) * S3_MINIMUM_MULTIPART_CHUNK_SIZE for n in range(8)]
+    mpu.upload_parts("foo", "foo", parts)
+    assert 1 < max_in_flight <= 3
+    body = s3.get_object(Bucket="foo", Key="foo")["Body"].read()
+    assert body == b"".join(parts)  # Parts were assembled in order
+
+
+@mock_s3
+def test_buffers_are_reused():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    buffer_ids = set()
+
+    class BufferTrackingMultipartUploader(MultipartUploader):
+        def read_chunk_into(self, fp, buffer):
+            buffer_ids.add(id(buffer))
+            return super().read_chunk_into(fp, buffer)
+
+    data = b"\xc0" * (S3_MINIMUM_MULTIPART_CHUNK_SIZE * 6 + 100)
+    mpu = BufferTrackingMultipartUploader(s3, max_concurrency=2)
+    mpu.upload_file("foo", "foo", BytesIO(data), chunk_size=S3_MINIMUM_MULTIPART_CHUNK_SIZE)
+    assert len(buffer_ids) <= mpu.max_concurrency + mpu.read_ahead_parts + 1
+    assert s3.get_object(Bucket="foo", Key="foo")["Body"].read() == data
+
+
+@mock_s3
+def test_buffers_are_sized_to_the_data():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    buffer_sizes = []
+
+    class BufferTrackingMultipartUploader(MultipartUploader):
+        def read_chunk_into(self, fp, buffer):
+            buffer_sizes.append(len(buffer))
+            return super().read_chunk_into(fp, buffer)
+
+    # A stream of unknown size is read in `default_chunk_size` chunks, but that's way more than there is.
+    data = b"\xc0" * (S3_MINIMUM_MULTIPART_FILE_SIZE * 2)
+    mpu = BufferTrackingMultipartUploader(s3)
+    mpu.upload_file("foo", "foo", BytesIO(data))
+    assert buffer_sizes and max(buffer_sizes) == len(data)
+    assert s3.get_object(Bucket="foo", Key="foo")["Body"].read() == data
+
+
+@mock_s3
+def test_md5_checksum():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    data = b"\xc0" * (S3_MINIMUM_MULTIPART_CHUNK_SIZE * 2 + 100)
+    mpu = MultipartUploader(s3, checksum="md5")
+    mpu.upload_file("foo", "foo", BytesIO(data), chunk_size=S3_MINIMUM_MULTIPART_CHUNK_SIZE)
+    assert mpu.etag.endswith('-3"')
+    assert mpu.etag == s3.head_object(Bucket="foo", Key="foo")["ETag"]
+
+
+@mock_s3
+def test_crc32c_checksum():
+    google_crc32c = pytest.importorskip("google_crc32c")
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="foo")
+    calls = {}
+
+    def record_calls(method_name):
+        original_method = getattr(s3, method_name)
+
+        def method(**args):
+            calls.setdefault(method_name, []).append(args)
+            return original_method(**args)
+
+        setattr(s3, method_name, method)
+
+    for method_name in ("create_multipart_upload", "upload_part", "complete_multipart_upload"):
+        record_calls(method_name)
+
+    parts = [bytes((n,)) * S3_MINIMUM_MULTIPART_CHUNK_SIZE for n in range(2)] + [b"\xc0" * 100]
+    mpu = MultipartUploader(s3, checksum="crc32c")
+    mpu.upload_file("foo", "foo", BytesIO(b"".join(parts)), chunk_size=S3_MINIMUM_MULTIPART_CHUNK_SIZE)
+
+    part_digests = [google_crc32c.value(part).to_bytes(4, "big") for part in parts]
+    assert calls["create_multipart_upload"][0]["ChecksumAlgorithm"] == "CRC32C"
+    sent_checksums = {args["PartNumber"]: args["ChecksumCRC32C"] for args in calls["upload_part"]}
+    assert sent_checksums == {n: base64.b64encode(digest).decode() for n, digest in enumerate(part_digests, 1)}
+    completed_parts = calls["complete_multipart_upload"][0]["MultipartUpload"]["Parts"]
+    assert [part["ChecksumCRC32C"] for part in completed_parts] == [sent_checksums[n] for n in (1, 2, 3)]
+    # S3 reports the checksum of the concatenated part checksums (moto doesn't compute it, so do it here).
+    composite_digest = google_crc32c.value(b"".join(part_digests)).to_bytes(4, "big")
+    assert mpu.checksum == base64.b64encode(composite_digest).decode() + "-3"
+
+
+def test_crc32c_of_buffers(monkeypatch):
+    google_crc32c = pytest.importorskip("google_crc32c")
+    from hai import boto3_multipart_upload
+
+    monkeypatch.setattr(boto3_multipart_upload, "_CRC32C_BLOCK_SIZE", 7)
+    data = bytes(range(100))
+    for buffer in (data, bytearray(data), memoryview(bytearray(data))):
+        assert boto3_multipart_upload._crc32c(buffer) == google_crc32c.value(data)
+
+
+def test_invalid_checksum():
+    with pytest.raises(ValueError):
+        MultipartUploader(None, checksum="sha0")
+
+
+def test_small_connection_pool_warning(caplog):
+    s3 = boto3.client("s3", region_name="us-east-1", config=Config(max_pool_connections=2))
+    MultipartUploader(s3, max_concurrency=2)
+    assert not caplog.records
+    MultipartUploader(s3, max_concurrency=4)
+    assert "max_pool_connections" in caplog.text
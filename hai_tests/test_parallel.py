@@ -1,3 +1,5 @@
+import functools
+import threading
 import time
 from unittest.mock import MagicMock
 
@@ -53,6 +55,14 @@ def test_parallel_retval():
         assert parallel.return_values == {"blerg": True, "return_true": True}
 
 
+def test_parallel_task_name_without_dunder_name():
+    task = functools.partial(return_true)
+    with ParallelRun() as parallel:
+        parallel.add_task(task)
+        parallel.wait()
+        assert parallel.return_values == {str(task): True}
+
+
 def test_parallel_wait_without_fail_fast():
     with ParallelRun() as parallel:
         parallel.add_task(return_true, name="true")
@@ -65,6 +75,10 @@ def test_parallel_wait_without_fail_fast():
         assert len(ei.value.exception_map) == 1
         assert isinstance(ei.value.exception_map["agh"], RuntimeError)
         assert ei.value.failed_task_names == {"agh"}
+        with pytest.raises(TasksFailed):
+            parallel.wait(fail_fast=False, raise_on_failure=True)
+        assert dict(parallel.iter_return_values()) == parallel.return_values
+        assert dict(parallel.iter_exceptions()) == parallel.exceptions
 
 
 @pytest.mark.parametrize("is_empty_run", (False, True))
@@ -84,14 +98,14 @@ def test_parallel_limit(fail):
 
     The `fail = True` mode checks that the test itself works.
     """
-    count = 0
+    slots = threading.BoundedSemaphore(3)
 
     def tick():
-        nonlocal count
-        assert count <= 3
-        count += 1
-        time.sleep(0.1)
-        count -= 1
+        assert slots.acquire(blocking=False)
+        try:
+            time.sleep(0.1)
+        finally:
+            slots.release()
 
     with ParallelRun(parallelism=(5 if fail else 3)) as parallel:
         for x in range(6):
@@ -101,7 +115,6 @@ def test_parallel_limit(fail):
                 parallel.wait(fail_fast=True)
         else:
             parallel.wait(fail_fast=True)
-            assert count == 0
 
 
 def test_parallel_long_interval_interruptible():
@@ -123,6 +136,148 @@ def test_parallel_max_wait():
             parallel.wait(interval=0.1, max_wait=0.5)
 
 
+def test_parallel_exit_lets_tasks_finish():
+    with ParallelRun(parallelism=1) as parallel:
+        tasks = [parallel.add_task(time.sleep, args=(0.1,)) for x in range(3)]
+    assert all(task.done() and not task.cancelled() for task in tasks)
+
+
+def test_parallel_exit_on_error_cancels_tasks():
+    with pytest.raises(ValueError), ParallelRun(parallelism=1) as parallel:
+        tasks = [parallel.add_task(time.sleep, args=(0.1,)) for x in range(3)]
+        raise ValueError("oops")
+    assert tasks[-1].cancelled()
+
+
+def test_parallel_shared_pool():
+    with ParallelRun() as a, ParallelRun() as b, ParallelRun(owned=True) as c:
+        assert a.pool is b.pool
+        assert c.pool is not a.pool
+        # A run created within a shared pool task must not wait on the same pool
+        nested = a.add_task(ParallelRun).result()
+        assert nested.pool is not a.pool
+        nested.close()
+    assert not a.pool._shutdown
+
+
+def test_parallel_add_tasks():
+    def check(x):
+        if x == 5:
+            raise ValueError("five")
+        return x * 2
+
+    with ParallelRun() as parallel:
+        tasks = parallel.add_tasks(check, range(10), chunksize=3)
+        parallel.wait(fail_fast=False)
+        assert len(tasks) == 10
+        assert parallel.return_values["check_9"] == 18
+        assert set(parallel.exceptions) == {"check_5"}
+        parallel.add_tasks(str, ["a", "b"], name_fn=lambda item: f"item {item}")
+        parallel.wait(fail_fast=False)
+        assert parallel.return_values["item b"] == "b"
+
+
+def test_parallel_add_tasks_run_in_parallel():
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def sleep(seconds):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(seconds)
+        with lock:
+            running -= 1
+
+    with ParallelRun(parallelism=4) as parallel:
+        parallel.add_tasks(sleep, [0.05] * 10)
+        parallel.wait()
+    assert max_running == 4
+
+
+def test_parallel_add_tasks_to_closed_pool():
+    parallel = ParallelRun(owned=True)
+    parallel.close()
+    with pytest.raises(RuntimeError):
+        parallel.add_tasks(str, range(3))
+    assert parallel.wait(fail_fast=False, max_wait=1)  # Doesn't hang on the unsubmitted tasks
+    assert set(parallel.exceptions) == {"str_0", "str_1", "str_2"}
+
+
+def test_parallel_default_parallelism(monkeypatch):
+    monkeypatch.setenv("HAI_PARALLELISM_MULT", "3")
+    with ParallelRun(owned=True) as parallel:
+        assert parallel.pool._max_workers % 3 == 0
+
+
+@pytest.mark.parametrize("value", ("2.5", ""))
+def test_parallel_invalid_parallelism_mult(monkeypatch, value):
+    monkeypatch.setenv("HAI_PARALLELISM_MULT", value)
+    with pytest.warns(UserWarning, match="HAI_PARALLELISM_MULT"), ParallelRun(owned=True) as parallel:
+        assert parallel.pool._max_workers % 2 == 0
+
+
+def test_parallel_inline_threshold():
+    with ParallelRun(inline_threshold=2) as parallel:
+        inline_task = parallel.add_task(threading.get_ident)
+        assert inline_task.done()
+        parallel.add_task(agh)
+        pool_task = parallel.add_task(threading.get_ident, name="pool")
+        parallel.wait(fail_fast=False)
+        assert inline_task.result() == threading.get_ident() != pool_task.result()
+        assert parallel.exceptions["agh"].args[0] == "agh!"
+
+
+def interrupt():
+    raise KeyboardInterrupt()
+
+
+def test_parallel_inline_task_interrupt():
+    with ParallelRun(inline_threshold=1) as parallel:
+        with pytest.raises(KeyboardInterrupt):
+            parallel.add_task(interrupt)
+        parallel.wait(max_wait=1)  # Nothing left hanging
+
+
+def run_chord_with_interrupt(parallel: ParallelRun):
+    chord = parallel.chord()
+    chord.add_task(interrupt)
+    chord.wait()
+
+
+def test_parallel_inline_chord_task_interrupt():
+    # With a single thread, the chord's task is run by `chord.wait()` in the outer task's thread.
+    with ParallelRun(parallelism=1) as parallel:
+        task = parallel.add_task(run_chord_with_interrupt, kwargs={"parallel": parallel})
+        parallel.wait(fail_fast=False)
+        assert isinstance(task.exception(), KeyboardInterrupt)
+
+
+def test_parallel_drain_completed():
+    with ParallelRun() as parallel:
+        parallel.add_task(return_true)
+        parallel.add_task(agh)
+        parallel.wait(fail_fast=False)
+        drained = dict(parallel.drain_completed())
+        assert drained["return_true"] is True
+        assert isinstance(drained["agh"], RuntimeError)
+        assert not (parallel.tasks or parallel.return_values or parallel.exceptions)
+        # The drained failure doesn't fail later waits
+        parallel.add_task(return_true, name="again")
+        parallel.wait()
+        parallel.clear()
+        assert not parallel.tasks
+
+
+def test_parallel_as_completed():
+    with ParallelRun() as parallel:
+        slow_task = parallel.add_task(time.sleep, args=(0.3,))
+        fast_task = parallel.add_task(return_true)
+        assert list(parallel.as_completed()) == [fast_task, slow_task]
+
+
 def test_parallel_chord_task():
     with ParallelRun() as parallel:
         for i in range(3):
@@ -139,6 +294,51 @@ def test_parallel_chord_task():
         }
 
 
+def test_parallel_chord_task_single_thread():
+    # Every chord is waited for in the only pool thread, so the chords' tasks must run there too.
+    with ParallelRun(parallelism=1) as parallel:
+        for i in range(3):
+            parallel.add_task(run_chord, kwargs={"parallel": parallel}, name="chord_%d" % i)
+        parallel.wait(max_wait=10)
+        assert parallel.return_values == {"chord_%d" % i: {"task_0": True, "task_1": True} for i in range(3)}
+
+
+def test_parallel_chord_max_wait():
+    busy = threading.Event()
+    with ParallelRun(parallelism=1) as parallel:
+        parallel.add_task(busy.wait, args=(5,))
+        chord = parallel.chord()
+        for i in range(3):
+            chord.add_task(time.sleep, args=(0.3,), name=f"sleep_{i}")
+        # Waiting outside the pool doesn't run the chord's tasks, so the wait times out on time...
+        t0 = time.time()
+        with pytest.raises(TimeoutError):
+            chord.wait(max_wait=0.2)
+        assert time.time() - t0 < 0.3
+        assert not chord.completed_tasks
+        busy.set()
+
+
+def run_chord_with_max_wait(parallel: ParallelRun):
+    chord = parallel.chord()
+    for i in range(3):
+        chord.add_task(time.sleep, args=(0.3,), name=f"sleep_{i}")
+    callback_calls = []
+    try:
+        chord.wait(max_wait=0.1, callback=callback_calls.append)
+    except TimeoutError:
+        return (len(chord.completed_tasks), len(callback_calls))
+    raise AssertionError("should have timed out")  # pragma: no cover
+
+
+def test_parallel_inline_chord_max_wait():
+    # ... while waiting in the pool runs them one by one, checking for timeouts in between.
+    with ParallelRun(parallelism=1) as parallel:
+        task = parallel.add_task(run_chord_with_max_wait, kwargs={"parallel": parallel})
+        parallel.wait()
+        assert task.result() == (1, 1)  # One task run and one callback call before timing out
+
+
 def test_parallel_chord_task_fail():
     """
     Test that failures inside a chord don't interrupt other chords or tasks
@@ -1,7 +1,11 @@
 import contextlib
+import os
 import subprocess
+import time
 
-from hai.pipe_pump import ChunkPipePump, LinePipePump
+import pytest
+
+from hai.pipe_pump import BasePipePump, ChunkPipePump, LinePipePump
 
 
 def test_line_pipe_pump():
@@ -54,3 +58,116 @@ def test_chunk_pipe_pump():
     chunk_lengths = [len(chunk) for chunk in chunks]
     assert chunk_lengths == [256, 256, 256, 232]
     assert sum(chunk_lengths) == 1000
+
+
+@pytest.mark.parametrize("accumulate_as_bytearray", (False, True))
+def test_line_pipe_pump_fragmented_feed(accumulate_as_bytearray):
+    pp = LinePipePump(separator=b"\r\n", accumulate_as_bytearray=accumulate_as_bytearray)
+    handled_lines = []
+    pp.add_line_handler(lambda key, lines: handled_lines.append(lines[-1]))
+    pp.register("test", None)
+    for byte in b"first\r\nsecond\r\nthi":
+        pp.feed("test", bytes([byte]))
+    assert handled_lines == [b"first", b"second"]
+    assert pp.buffers["test"] == b"thi"
+    pp.close()
+    assert pp.get_value("test") == b"first\r\nsecond\r\nthi"
+    assert all(type(line) is bytes for line in handled_lines)
+    assert bool(pp.lines) != accumulate_as_bytearray
+
+
+@pytest.mark.parametrize("zero_copy_handlers", (False, True))
+def test_chunk_pipe_pump_feed(zero_copy_handlers):
+    chunks = []
+    pp = ChunkPipePump(chunk_size=4, zero_copy_handlers=zero_copy_handlers)
+    pp.add_chunk_handler(lambda key, chunk: chunks.append(bytes(chunk)))
+    pp.register("test", None)
+    pp.feed("test", b"0123456789")
+    pp.feed("test", b"abcdef")
+    pp.close()
+    assert chunks == [b"0123", b"4567", b"89ab", b"cdef"]
+
+
+def test_process_buffer_returning_leftovers():
+    class WordPipePump(BasePipePump):
+        def __init__(self):
+            super().__init__()
+            self.words = []
+
+        def _process_buffer(self, key, buffer):
+            *words, leftover = bytes(buffer).split(b" ")
+            self.words.extend(words)
+            return leftover
+
+    pp = WordPipePump()
+    pp.register("test", None)
+    pp.feed("test", b"one tw")
+    pp.feed("test", b"o three")
+    assert pp.words == [b"one", b"two"]
+    assert pp.buffers["test"] == b"three"
+    pp.close()
+
+
+def test_line_pipe_pump_shared_key():
+    pipes = [os.pipe(), os.pipe()]
+    with contextlib.closing(LinePipePump()) as pp:
+        for read_fd, write_fd in pipes:
+            pp.register("out", read_fd)
+            os.write(write_fd, b"line\n")
+        pp.pump()
+        assert pp.lines["out"] == [b"line", b"line"]
+    for fds in pipes:
+        for fd in fds:
+            os.close(fd)
+
+
+def test_close_wakes_pump_thread():
+    read_fd, write_fd = os.pipe()
+    pp = LinePipePump()
+    pp.register("out", read_fd)
+    thread = pp.as_thread(interval=30)
+    thread.start()
+    time.sleep(0.1)  # Let the thread start waiting
+    t0 = time.time()
+    pp.close()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert time.time() - t0 < 5
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_double_close(tmpdir):
+    pp = LinePipePump()
+    pp.close()
+    # The pump's selector and wake-up pipe are closed now, so these likely reuse their file descriptor numbers.
+    fds = [os.open(str(tmpdir.join(str(n))), os.O_RDWR | os.O_CREAT) for n in range(3)]
+    try:
+        pp.close()
+        for fd in fds:
+            assert os.fstat(fd).st_size == 0  # Nothing was written into someone else's file
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def test_eof_unregisters():
+    read_fd, write_fd = os.pipe()
+    pp = LinePipePump()
+    pp.register("out", read_fd)
+    os.write(write_fd, b"hello\nworld")
+    os.close(write_fd)
+    pp.pump(max_reads=5)
+    assert read_fd not in {key.fd for key in pp.selector.get_map().values()}
+    pp.close()
+    assert pp.get_value("out") == b"hello\nworld"
+    os.close(read_fd)
+
+
+def test_wake_up_pipe_is_drained():
+    pp = LinePipePump()
+    pp._stop_pumping()
+    pp.pump(timeout=0)
+    with pytest.raises(BlockingIOError):
+        os.read(pp._wake_r, 1)
+    pp.close()
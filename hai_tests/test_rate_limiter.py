@@ -1,8 +1,10 @@
+import copy
+import pickle
 import time
 
 import pytest
 
-from hai.rate_limiter import MultiRateLimiter, Rate, RateLimiter, StateChange
+from hai.rate_limiter import STATE_CHANGE_MAP, MultiRateLimiter, Rate, RateLimiter, StateChange, TickResult
 
 
 def test_rate_limiter():
@@ -95,6 +97,13 @@ def test_rate_construction_validation():
         Rate(1, 0)
 
 
+def test_multi_limiter_construction_validation():
+    with pytest.raises(TypeError):
+        MultiRateLimiter(default_limit=1)
+    with pytest.raises(TypeError):
+        MultiRateLimiter(default_limit=Rate(1), per_name_limits={"foo": 1})
+
+
 def test_multi_limiter():
     ml = MultiRateLimiter(default_limit=Rate(1, 0.1))
     # Tick two limiters:
@@ -116,3 +125,84 @@ def test_smoke_reprs():
     assert isinstance(repr(l), str)
     assert isinstance(repr(l.rate), str)
     assert isinstance(repr(l.tick()), str)
+
+
+@pytest.mark.parametrize("state", (False, True))
+@pytest.mark.parametrize("did_change", (False, True))
+def test_tick_result_state_change(state, did_change):
+    assert TickResult(state, did_change).state_change == STATE_CHANGE_MAP[(did_change, state)]
+
+
+def test_tick_results_are_shared_and_immutable():
+    l = RateLimiter.from_per_second(1)
+    r = l.tick()
+    assert r is RateLimiter.from_per_second(1).tick()
+    with pytest.raises(AttributeError):
+        r.state = False
+    assert r.state
+
+
+@pytest.mark.parametrize(
+    "copier",
+    (copy.copy, copy.deepcopy, lambda r: pickle.loads(pickle.dumps(r))),
+    ids=("copy", "deepcopy", "pickle"),
+)
+def test_tick_result_copy(copier):
+    r = TickResult(False, True)
+    r_copy = copier(r)
+    assert (r_copy.state, r_copy.did_change) == (False, True)
+    with pytest.raises(AttributeError):
+        r_copy.state = True
+
+
+class FakeClockRateLimiter(RateLimiter):
+    __slots__ = ()
+    now = 0.0
+    clock = staticmethod(lambda: FakeClockRateLimiter.now)
+
+
+@pytest.mark.parametrize("allow_underflow", (False, True))
+def test_tick_many(allow_underflow):
+    l1 = FakeClockRateLimiter.from_per_second(10, allow_underflow=allow_underflow)
+    l2 = FakeClockRateLimiter.from_per_second(10, allow_underflow=allow_underflow)
+    assert l1.tick_many(0) == []
+    for now in (0.0, 0.35, 0.5):
+        FakeClockRateLimiter.now = now
+        assert l1.tick_many(12) == [l2.tick() for _ in range(12)]
+        assert l1.allowance == pytest.approx(l2.allowance)
+        assert l1.current_state == l2.current_state
+
+
+def test_multi_limiter_max_limiters():
+    ml = MultiRateLimiter(default_limit=Rate(1, 10), max_limiters=2)
+    assert ml.tick("foo")
+    assert ml.tick("bar")
+    assert not ml.tick("foo")  # Makes "bar" the least recently used one
+    assert ml.tick("baz")
+    assert list(ml.limiters) == ["foo", "baz"]
+    assert not ml.tick("foo")
+    assert ml.tick("bar")  # Evicted, so it's a fresh limiter
+
+
+def test_multi_limiter_evict_stale(monkeypatch):
+    class FakeClockMultiRateLimiter(MultiRateLimiter):
+        rate_limiter_class = FakeClockRateLimiter
+
+    FakeClockRateLimiter.now = 0.0
+    ml = FakeClockMultiRateLimiter(default_limit=Rate(1, 10))
+    ml.tick("foo")
+    FakeClockRateLimiter.now = 5.0
+    ml.tick("bar")
+    FakeClockRateLimiter.now = 8.0
+    # Existing limiters keep using the clock they were constructed with.
+    monkeypatch.setattr(FakeClockRateLimiter, "clock", staticmethod(lambda: 1000.0))
+    assert ml.evict_stale(max_age=4) == 1
+    assert list(ml.limiters) == ["bar"]
+
+
+def test_rate_limiter_rate_change():
+    l = RateLimiter.from_per_second(1)
+    l.rate = Rate(2)
+    assert l.tick()
+    assert l.tick()
+    assert not l.tick()